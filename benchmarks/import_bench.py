@@ -0,0 +1,85 @@
+"""Import time and memory of simsimpy modules.
+
+Every statement is run in a fresh interpreter, which reports time of the
+statement, growth of its maximal resident set size and whether numpy and
+scipy got imported. Results are printed as JSON.
+
+Usage:
+    python benchmarks/import_bench.py --repeat 5 --output imports.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+
+STATEMENTS = [
+    'import simsimpy',
+    'from simsimpy import SubsetStorage',
+    'import simsimpy.intstep',
+    'import simsimpy.rand_wraps',
+    'import simsimpy.optimize',
+    'from simsimpy.optimize import scipy_walk',
+    'from simsimpy.optimize import scipy_walk; '
+    'scipy_walk(lambda x: 1. + x[0]**2, [1.], dx=0.5)',
+]
+
+_PROBE = '''
+import resource, sys, time
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+      'numpy' in sys.modules, 'scipy' in sys.modules)
+'''
+
+
+def measure(statement, repeat=5):
+    """Best time and memory of statement over repeat interpreters."""
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', _PROBE, statement], env=env,
+            universal_newlines=True).split()
+        runs.append((float(out[0]), int(out[1]), out[2] == 'True',
+                     out[3] == 'True'))
+    return {'statement': statement,
+            'time': min(r[0] for r in runs),
+            # kilobytes on Linux
+            'max_rss_growth': min(r[1] for r in runs),
+            'numpy': runs[0][2], 'scipy': runs[0][3]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None,
+                        help='JSON file, printed to stdout if not set.')
+    args = parser.parse_args(argv)
+
+    results = []
+    for statement in STATEMENTS:
+        res = measure(statement, args.repeat)
+        results.append(res)
+        print('%-70s %8.4fs %8d kB scipy %s' % (
+            statement, res['time'], res['max_rss_growth'], res['scipy']),
+            file=sys.stderr)
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(), 'results': results}
+    if args.output is None:
+        print(json.dumps(report, indent=1))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Benchmarks of simsimpy.intstep against scipy.integrate.solve_ivp.
+
+Runs standard problems at several state sizes and prints results as JSON:
+wall time, steps per second, right side calls, peak traced memory and error
+at the final time against a reference solution.
+
+Usage:
+    python benchmarks/intstep_bench.py --sizes 1 100 --output bench.json
+
+Problems:
+    oscillator: independent harmonic oscillators, exact solution.
+    lorenz: independent Lorenz systems with different rho.
+    lif: leaky integrate-and-fire population without threshold, exact.
+    hh: Hodgkin-Huxley neurons with different input currents.
+Reference for problems without exact solution is solve_ivp with DOP853 and
+tight tolerances.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+# run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simsimpy import intstep
+
+
+class Problem(object):
+    """Test problem of size n.
+
+    Attributes:
+    y0: initial state.
+    t1: end time, integration starts at 0.
+    dt: step of fixed-step methods and spacing of records.
+    """
+    def right_side(self, t, y, out):
+        raise NotImplementedError
+
+    def exact(self, t):
+        """Exact solution at t, None if unknown."""
+        return None
+
+    def scipy_right_side(self, t, y):
+        out = numpy.empty(self.y0.shape)
+        self.right_side(t, y.reshape(self.y0.shape), out)
+        return out.ravel()
+
+    def reference(self):
+        """Solution at t1 to compare the methods with."""
+        exact = self.exact(self.t1)
+        if exact is not None:
+            return exact
+        from scipy.integrate import solve_ivp
+
+        sol = solve_ivp(self.scipy_right_side, (0., self.t1), self.y0.ravel(),
+                        method='DOP853', rtol=1e-11, atol=1e-12)
+        return sol.y[:, -1].reshape(self.y0.shape)
+
+
+class Oscillator(Problem):
+    def __init__(self, n):
+        self.w = numpy.linspace(1., 2., n)
+        self.y0 = numpy.zeros((2, n))
+        self.y0[0] = 1.
+        self.t1 = 10.
+        self.dt = 0.01
+
+    def right_side(self, t, y, out):
+        out[0] = y[1]
+        numpy.multiply(y[0], -self.w**2, out=out[1])
+
+    def exact(self, t):
+        return numpy.array([numpy.cos(self.w*t),
+                            -self.w*numpy.sin(self.w*t)])
+
+
+class Lorenz(Problem):
+    def __init__(self, n):
+        self.rho = numpy.linspace(20., 28., n)
+        self.y0 = numpy.ones((3, n))
+        self.t1 = 2.
+        self.dt = 0.001
+
+    def right_side(self, t, y, out):
+        x, v, z = y
+        out[0] = 10. * (v - x)
+        out[1] = x * (self.rho - z) - v
+        out[2] = x * v - 8./3 * z
+
+
+class LIF(Problem):
+    def __init__(self, n):
+        self.tau = 10.
+        self.current = numpy.linspace(0.5, 2., n)
+        self.y0 = numpy.zeros(n)
+        self.t1 = 100.
+        self.dt = 0.1
+
+    def right_side(self, t, y, out):
+        numpy.subtract(self.current, y, out=out)
+        out /= self.tau
+
+    def exact(self, t):
+        return self.current * -numpy.expm1(-t / self.tau)
+
+
+class HH(Problem):
+    def __init__(self, n):
+        self.current = numpy.linspace(5., 15., n)
+        self.y0 = numpy.empty((4, n))
+        self.y0[:] = numpy.array([-65., 0.05, 0.6, 0.32])[:, None]
+        self.t1 = 50.
+        self.dt = 0.01
+
+    def right_side(self, t, y, out):
+        v, m, h, n = y
+        am = 0.1 * (v + 40.) / -numpy.expm1(-(v + 40.) / 10.)
+        bm = 4. * numpy.exp(-(v + 65.) / 18.)
+        ah = 0.07 * numpy.exp(-(v + 65.) / 20.)
+        bh = 1. / (1. + numpy.exp(-(v + 35.) / 10.))
+        an = 0.01 * (v + 55.) / -numpy.expm1(-(v + 55.) / 10.)
+        bn = 0.125 * numpy.exp(-(v + 65.) / 80.)
+        out[0] = (self.current - 120. * m**3 * h * (v - 50.) -
+                  36. * n**4 * (v + 77.) - 0.3 * (v + 54.387))
+        out[1] = am * (1. - m) - bm * m
+        out[2] = ah * (1. - h) - bh * h
+        out[3] = an * (1. - n) - bn * n
+
+
+PROBLEMS = {'oscillator': Oscillator, 'lorenz': Lorenz, 'lif': LIF, 'hh': HH}
+METHODS = ['euler', 'rk4', 'dopri5', 'scipy_RK45', 'scipy_LSODA']
+
+
+def _run(problem, method, rtol):
+    """Integrates problem with method, returns final state and counters."""
+    if method.startswith('scipy_'):
+        from scipy.integrate import solve_ivp
+
+        sol = solve_ivp(problem.scipy_right_side, (0., problem.t1),
+                        problem.y0.ravel(), method=method[6:], rtol=rtol,
+                        atol=rtol*1e-3)
+        return (sol.y[:, -1].reshape(problem.y0.shape),
+                {'nfev': sol.nfev, 'steps': sol.t.size - 1})
+    options = {'rtol': rtol, 'atol': rtol*1e-3} if method == 'dopri5' else {}
+    n_records = int(round(problem.t1 / problem.dt))
+    res = intstep.integrate(problem.right_side, problem.y0, 0., problem.t1,
+                            problem.dt, method=method,
+                            record_every=n_records, **options)
+    counters = dict((k, v) for k, v in res.items()
+                    if k not in ('t', 'y', 'stats'))
+    counters['steps'] = res.get('naccept', n_records)
+    return res['y'][-1], counters
+
+
+def bench(problem, method, rtol=1e-6, repeat=3):
+    """Measures one method on one problem, returns dictionary of results."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        y, counters = _run(problem, method, rtol)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    _run(problem, method, rtol)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    ref = problem.reference()
+    error = float(numpy.max(numpy.abs(y - ref)) /
+                  max(1., float(numpy.max(numpy.abs(ref)))))
+    res = {'time': min(times), 'steps_per_sec': counters['steps']/min(times),
+           'peak_memory': peak, 'error': error}
+    res.update((k, int(v)) for k, v in counters.items())
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--problems', nargs='+', default=sorted(PROBLEMS),
+                        choices=sorted(PROBLEMS))
+    parser.add_argument('--methods', nargs='+', default=METHODS,
+                        choices=METHODS)
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1, 100, 10000])
+    parser.add_argument('--rtol', type=float, default=1e-6)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None,
+                        help='JSON file, printed to stdout if not set.')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.problems:
+        for size in args.sizes:
+            problem = PROBLEMS[name](size)
+            for method in args.methods:
+                res = bench(problem, method, args.rtol, args.repeat)
+                res.update({'problem': name, 'size': size, 'method': method})
+                results.append(res)
+                print('%-10s %6d %-12s %9.4fs error %.2e' % (
+                    name, size, method, res['time'], res['error']),
+                    file=sys.stderr)
+
+    report = {'python': platform.python_version(),
+              'numpy': numpy.__version__, 'platform': platform.platform(),
+              'rtol': args.rtol, 'results': results}
+    if args.output is None:
+        print(json.dumps(report, indent=1))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
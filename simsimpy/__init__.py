@@ -1,8 +1,25 @@
-"""Main module for SimSimPy package."""
+"""Main module for SimSimPy package.
 
-__all__ = ["random", "other", "optimize"]
+Submodules are imported on first access, so import simsimpy is cheap and
+e.g. scipy is loaded only when an optimizer is used.
+"""
+import importlib
 
-from . import other
-from . import rand_wraps
-from . import optimize
-from .subset import SubsetStorage
+__all__ = ["other", "rand_wraps", "optimize", "profile", "intstep",
+           "subset", "SubsetStorage"]
+
+_submodules = ["other", "rand_wraps", "optimize", "profile", "intstep",
+               "subset"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name == 'SubsetStorage':
+        from .subset import SubsetStorage
+        return SubsetStorage
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
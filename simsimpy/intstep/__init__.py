@@ -0,0 +1,19 @@
+"""Integration step module of SimSimPy package.
+
+Contains list-based euler and rk4 steps, in-place numpy steppers and
+integrate driver, that runs a whole trajectory and detects events on the way.
+integrate_to_file streams long runs to disk with checkpoints.
+"""
+
+__all__ = ["fixed", "dopri", "stiff", "exponential", "sde", "events", "driver",
+           "stream"]
+
+from .fixed import euler, rk4
+from .fixed import Stepper, EulerStepper, RK4Stepper
+from .dopri import DormandPrinceStepper
+from .stiff import BackwardEulerStepper
+from .exponential import ExponentialStepper
+from .sde import WienerIncrements, EulerMaruyamaStepper, MilsteinStepper
+from .events import Event
+from .driver import METHODS, integrate, integrate_ensemble
+from .stream import integrate_chunks, integrate_to_file
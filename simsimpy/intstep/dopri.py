@@ -0,0 +1,207 @@
+"""Adaptive Dormand-Prince 5(4) integration.
+
+Embedded Runge-Kutta pair with first-same-as-last stage reuse, error control
+by per-component rtol/atol and 4th order dense output, see Hairer, Norsett,
+Wanner, Solving Ordinary Differential Equations I, II.4-II.6.
+"""
+import numpy
+
+from .fixed import Stepper
+
+C = [0., 1/5, 3/10, 4/5, 8/9, 1.]
+A = [[],
+     [1/5],
+     [3/40, 9/40],
+     [44/45, -56/15, 32/9],
+     [19372/6561, -25360/2187, 64448/6561, -212/729],
+     [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]]
+B = [35/384, 0., 500/1113, 125/192, -2187/6784, 11/84]
+# difference between 5th and embedded 4th order weights, includes k7
+E = [-71/57600, 0., 71/16695, -71/1920, 17253/339200, -22/525, 1/40]
+# dense output polynomial coefficients of x, x^2, x^3, x^4 for k1..k7
+P = [[1., -8048581381/2820520608, 8663915743/2820520608,
+      -12715105075/11282082432],
+     [0., 0., 0., 0.],
+     [0., 131558114200/32700410799, -68118460800/10900136933,
+      87487479700/32700410799],
+     [0., -1754552775/470086768, 14199869525/1410260304,
+      -10690763975/1880347072],
+     [0., 127303824393/49829197408, -318862633887/49829197408,
+      701980252875/199316789632],
+     [0., -282668133/205662961, 2019193451/616988883,
+      -1453857185/822651844],
+     [0., 40617522/29380423, -110615467/29380423, 69997945/29380423]]
+
+
+def _axpy(out, y, h, coefs, ks, scratch):
+    """out = y + h*sum(coefs[i]*ks[i]) without temporary arrays.
+
+    y set to None is treated as zero.
+    """
+    if y is None:
+        out.fill(0)
+    else:
+        out[...] = y
+    for c, k in zip(coefs, ks):
+        if c:
+            numpy.multiply(k, h*c, out=scratch)
+            out += scratch
+
+
+class DormandPrinceStepper(Stepper):
+    """Adaptive Dormand-Prince 5(4) stepper on numpy arrays.
+
+    Unlike fixed steppers it is advanced with advance(), which picks the step
+    size itself. After every accepted step the state inside it can be
+    interpolated with dense().
+
+    parameters:
+        n, dtype: see Stepper.
+        rtol, atol: relative and absolute tolerances, scalars or arrays
+            broadcastable to the state.
+        first_step: initial step size. Estimated from the right side if None.
+        max_step: upper limit of the step size.
+        safety, min_factor, max_factor: step size controller parameters.
+
+    Attributes:
+    h: step size to be tried next.
+    naccept, nreject: amount of accepted and rejected steps.
+    """
+    stages = ('k1', 'k2', 'k3', 'k4', 'k5', 'k6', 'k7', 'yold', 'ynew',
+              'scratch')
+    counters = ('nfev', 'naccept', 'nreject')
+    adaptive = True
+
+    def __init__(self, n, dtype=float, rtol=1e-6, atol=1e-9, first_step=None,
+                 max_step=numpy.inf, safety=0.9, min_factor=0.2,
+                 max_factor=10.):
+        super(DormandPrinceStepper, self).__init__(n, dtype)
+        self.rtol = self._rtol_full = self._per_row(numpy.asarray(rtol, float))
+        self.atol = self._atol_full = self._per_row(numpy.asarray(atol, float))
+        self.h = first_step
+        self.max_step = max_step
+        self.safety = safety
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.told = None
+        self.hold = None
+        self._fsal = False
+        self._scale = self._scale_full = numpy.empty(self.shape)
+        self._tmp = self._tmp_full = numpy.empty(self.shape)
+
+    def _norm(self, x, y, ynew):
+        """RMS norm of x scaled by atol + rtol*max(|y|, |ynew|)."""
+        if not x.size:
+            return 0.
+        scale, tmp = self._scale, self._tmp
+        numpy.abs(y, out=scale)
+        numpy.abs(ynew, out=tmp)
+        numpy.maximum(scale, tmp, out=scale)
+        scale *= self.rtol
+        scale += self.atol
+        numpy.abs(x, out=tmp)
+        tmp /= scale
+        return float(numpy.sqrt(numpy.vdot(tmp, tmp) / tmp.size))
+
+    def resize(self, m, order=None):
+        super(DormandPrinceStepper, self).resize(m, order)
+        self._scale = self._scale_full[:m]
+        self._tmp = self._tmp_full[:m]
+        self.rtol = self._rows(self._rtol_full, m, order)
+        self.atol = self._rows(self._atol_full, m, order)
+        self.reset()
+
+    def get_state(self):
+        state = super(DormandPrinceStepper, self).get_state()
+        state['h'] = self.h
+        return state
+
+    def set_state(self, state):
+        super(DormandPrinceStepper, self).set_state(state)
+        self.h = state['h']
+        self.reset()
+
+    def _initial_step(self, y, right_side, t, t_max, args):
+        """Initial step size, II.4 of Hairer et al."""
+        k1, ynew, scratch = self.k1, self.ynew, self.scratch
+        d0 = self._norm(y, y, y)
+        d1 = self._norm(k1, y, y)
+        h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+        h0 = min(h0, t_max - t)
+        _axpy(ynew, y, h0, [1.], [k1], scratch)
+        right_side(t + h0, ynew, self.k2, *args)
+        self.nfev += 1
+        numpy.subtract(self.k2, k1, out=scratch)
+        d2 = self._norm(scratch, y, y) / h0
+        if max(d1, d2) <= 1e-15:
+            h1 = max(1e-6, h0 * 1e-3)
+        else:
+            h1 = (0.01 / max(d1, d2)) ** (1/5)
+        return min(100 * h0, h1)
+
+    def advance(self, y, right_side, t, t_max, args=()):
+        """Makes one accepted step from t towards t_max, updating y in place.
+
+        Rejected attempts are repeated with smaller steps. Returns the new
+        time, which equals t_max exactly when it is reached.
+        """
+        if self._fsal:
+            # last stage of the previous step is the first stage of this one
+            self.k1, self.k7 = self.k7, self.k1
+        else:
+            right_side(t, y, self.k1, *args)
+            self.nfev += 1
+        if self.h is None:
+            self.h = self._initial_step(y, right_side, t, t_max, args)
+
+        ks = [self.k1, self.k2, self.k3, self.k4, self.k5, self.k6, self.k7]
+        ynew, scratch = self.ynew, self.scratch
+        max_factor = self.max_factor
+        while True:
+            h = min(self.h, self.max_step)
+            if h <= 10 * numpy.spacing(abs(t)):
+                raise RuntimeError('Step size underflow at t = %g.' % t)
+            if t + h >= t_max:
+                h = t_max - t
+                t_new = t_max
+            else:
+                t_new = t + h
+            for i in range(1, 6):
+                _axpy(ynew, y, h, A[i], ks, scratch)
+                right_side(t + C[i]*h, ynew, ks[i], *args)
+            _axpy(ynew, y, h, B, ks, scratch)
+            right_side(t_new, ynew, ks[6], *args)
+            self.nfev += 6
+
+            _axpy(self.yold, None, h, E, ks, scratch)
+            err = self._norm(self.yold, y, ynew)
+            if err <= 1.:
+                break
+            self.nreject += 1
+            self.h = h * max(self.min_factor, self.safety * err ** -0.2)
+            max_factor = 1.
+
+        if err == 0.:
+            factor = max_factor
+        else:
+            factor = min(max_factor, self.safety * err ** -0.2)
+        self.h = h * factor
+        self.naccept += 1
+        self.yold[...] = y
+        y[...] = ynew
+        self.told = t
+        self.hold = h
+        self._fsal = True
+        return t_new
+
+    def dense(self, t, out):
+        """Interpolates the state at t inside the last accepted step."""
+        x = (t - self.told) / self.hold
+        ks = [self.k1, self.k2, self.k3, self.k4, self.k5, self.k6, self.k7]
+        coefs = [p[0]*x + p[1]*x**2 + p[2]*x**3 + p[3]*x**4 for p in P]
+        _axpy(out, self.yold, self.hold, coefs, ks, self.scratch)
+        return out
+
+    def reset(self):
+        """Forgets the stored first stage, e.g. after y was changed outside."""
+        self._fsal = False
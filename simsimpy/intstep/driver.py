@@ -0,0 +1,512 @@
+"""Trajectory drivers.
+
+integrate runs a whole trajectory with one of the steppers and records it
+into a preallocated array or a SubsetStorage. Adaptive steppers record on
+the same fixed grid through their dense output.
+
+Events (threshold crossings with reset) are detected by Event objects, see
+events module.
+
+integrate_ensemble integrates many independent copies of the same model at
+once, evaluating right side for all of them in one call.
+"""
+import numpy
+
+from .. import profile
+from ..subset import SubsetStorage
+from .fixed import EulerStepper, RK4Stepper, _as_state
+from .dopri import DormandPrinceStepper
+from .stiff import BackwardEulerStepper
+from .exponential import ExponentialStepper
+from .sde import EulerMaruyamaStepper, MilsteinStepper
+
+
+METHODS = {'euler': EulerStepper, 'rk4': RK4Stepper,
+           'dopri5': DormandPrinceStepper,
+           'backward_euler': BackwardEulerStepper,
+           'exponential': ExponentialStepper,
+           'euler_maruyama': EulerMaruyamaStepper,
+           'milstein': MilsteinStepper}
+# options of the steppers, which are user callbacks
+CALLBACKS = ('jac', 'diffusion', 'diffusion_derivative')
+
+
+class _Members(object):
+    """Active members of an ensemble, see integrate_ensemble.
+
+    Finished members are moved to the end of the state and the stepper is
+    resized to the active ones.
+
+    Attributes:
+    m: amount of active members, they are y[:m].
+    order: order[i] is the original index of the member in row i.
+    args: per-member parameters of the active members.
+    t_done: time each member finished at, nan if it did not.
+    """
+    def __init__(self, y, params, done):
+        self.y = y
+        self.m = len(y)
+        self.order = numpy.arange(self.m)
+        self.params = [numpy.array(p) for p in params]
+        self.args = tuple(self.params)
+        self.done = profile.wrap(done, 'done')
+        self.t_done = numpy.full(self.m, numpy.nan)
+
+    def check(self, t, stepper):
+        """Drops finished members, returns True if any were dropped."""
+        m = self.m
+        if self.done is None or not m:
+            return False
+        finished = numpy.asarray(self.done(t, self.y[:m], *self.args), bool)
+        if not finished.any():
+            return False
+        keep = numpy.flatnonzero(~finished)
+        idx = numpy.concatenate((keep, numpy.flatnonzero(finished)))
+        for arr in [self.y, self.order] + self.params:
+            arr[:m] = arr[idx]
+        self.m = len(keep)
+        self.t_done[self.order[self.m:m]] = t
+        self.args = tuple(p[:self.m] for p in self.params)
+        stepper.resize(self.m, idx)
+        return True
+
+
+def _fixed_records(stepper, right_side, y, t0, dt, n_records, record_every,
+                   args=(), members=None, event=None, first=0):
+    """Advances y in place, yielding (t, y) after every record_every steps.
+
+    First record is the initial state, with index first (y is the state of
+    that record when a run is continued). If members are given, only active
+    ones are advanced. If event is terminal, the last record is made at its
+    time.
+    """
+    i = first * record_every
+    ya = y
+    if members is not None and members.check(t0 + i*dt, stepper):
+        ya, args = y[:members.m], members.args
+    if event is not None:
+        event.start(t0 + i*dt, y, args)
+    yield t0 + i*dt, y
+    for _ in range(n_records - 1 - first):
+        for _ in range(record_every):
+            t = t0 + i*dt
+            if event is not None:
+                event.save(y)
+            stepper.step(ya, right_side, t, dt, args)
+            i += 1
+            if members is not None and members.check(t0 + i*dt, stepper):
+                ya, args = y[:members.m], members.args
+            if event is not None:
+                t_ev = event.check(t, t0 + i*dt, y, right_side, args, stepper)
+                if t_ev is not None:
+                    yield t_ev, y
+                    return
+        yield t0 + i*dt, y
+
+
+def _adaptive_records(stepper, right_side, y, t0, dt, n_records,
+                      record_every, args=(), members=None, event=None,
+                      first=0):
+    """Same as _fixed_records for adaptive steppers.
+
+    Records between the accepted steps are interpolated.
+    """
+    out = numpy.empty_like(y)
+    step = dt * record_every
+    t_end = t0 + (n_records - 1) * step
+    t = t0 + first*step
+    k = first + 1
+    ya = y
+    if members is not None and members.check(t, stepper):
+        ya, args = y[:members.m], members.args
+    if event is not None:
+        event.start(t, y, args, stepper.dense)
+    yield t, y
+    while k < n_records:
+        t_old = t
+        t = stepper.advance(ya, right_side, t, t_end, args)
+        t_ev = None
+        if event is not None:
+            t_ev = event.check(t_old, t, y, right_side, args, stepper)
+        while k < n_records and t0 + k*step <= t:
+            if t_ev is not None and t0 + k*step >= t_ev:
+                break
+            tk = t0 + k*step
+            if tk == t:
+                yield t, y
+            else:
+                m = len(ya)
+                stepper.dense(tk, out[:m])
+                out[m:] = y[m:]
+                yield tk, out
+            k += 1
+        if t_ev is not None:
+            if event.terminal:
+                yield t_ev, y
+                return
+            # step was cut at an event with reset
+            t = t_ev
+        if members is not None and members.check(t, stepper):
+            ya, args = y[:members.m], members.args
+
+
+def _records(method, right_side, y, t0, t1, dt, record_every, args, options,
+             members=None, event=None, first=0):
+    """Creates the stepper and the generator of records.
+
+    Returns stepper, amount of records and the generator.
+    """
+    n_steps = int(round((t1 - t0) / dt))
+    n_records = n_steps // record_every + 1
+    options = dict(options)
+    for name in CALLBACKS:
+        if callable(options.get(name)):
+            options[name] = profile.wrap(options[name], name)
+    stepper = METHODS[method](y.shape, y.dtype, **options)
+    if stepper.adaptive:
+        records = _adaptive_records(stepper, right_side, y, t0, dt,
+                                    n_records, record_every, args, members,
+                                    event, first)
+    else:
+        records = _fixed_records(stepper, right_side, y, t0, dt, n_records,
+                                 record_every, args, members, event, first)
+    return stepper, n_records, records
+
+
+def _counters(res, stepper, event=None):
+    """Adds stepper counters and events to the result dictionary."""
+    for name in stepper.counters:
+        res[name] = getattr(stepper, name)
+    if event is not None:
+        res['t_events'] = event.t_events
+        res['i_events'] = event.i_events
+    return res
+
+
+def _run(method, right_side, y, t0, t1, dt, record_every, buf_size, args,
+         options, members=None, event=None):
+    """Common part of the drivers, returns the result dictionary."""
+    mark = profile.mark()
+    right_side = profile.wrap(right_side, 'right_side')
+    stepper, n_records, records = _records(method, right_side, y, t0, t1, dt,
+                                           record_every, args, options,
+                                           members, event)
+
+    if buf_size is None:
+        times = numpy.empty(n_records)
+        states = numpy.empty((n_records,) + y.shape, y.dtype)
+        i = 0
+        for t, yt in records:
+            times[i] = t
+            if members is None:
+                states[i] = yt
+            else:
+                states[i][members.order] = yt
+            i += 1
+        if i < n_records:
+            # stopped by a terminal event
+            times = times[:i]
+            states = states[:i]
+    else:
+        times = SubsetStorage(buf_size, n_records, float)
+        states = SubsetStorage(buf_size, n_records, y.dtype, y.shape)
+        for t, yt in records:
+            times.append(t)
+            if members is None:
+                states.append(yt)
+            else:
+                ordered = numpy.empty_like(yt)
+                ordered[members.order] = yt
+                states.append(ordered)
+    res = _counters({'t': times, 'y': states}, stepper, event)
+    res['stats'] = profile.stats(mark)
+    return res
+
+
+def _initial_state(y0, dtype):
+    if dtype is None:
+        return _as_state(y0)
+    return numpy.array(y0, dtype=dtype)
+
+
+def integrate(right_side, y0, t0, t1, dt, method='rk4', record_every=1,
+              buf_size=None, dtype=None, args=(), event=None, **options):
+    """Integrates right_side from t0 to t1.
+
+    Fixed-step methods make steps of dt. Adaptive methods choose the steps
+    themselves and interpolate the records, which are made on the same grid.
+
+    parameters:
+        right_side: right_side(t, y, out, *args), writes dy/dt into out.
+            For method 'exponential' it writes only the nonlinear part, the
+            linear one is given by options A and b.
+        y0: initial state, array-like of any shape.
+        t0, t1: integration interval. Amount of steps is round((t1-t0)/dt).
+        dt: integration step.
+        method: name of the stepper, one of METHODS.
+        record_every: state is recorded every record_every steps. Steps
+            after the last record are not made.
+        buf_size: if set, records are downsampled into SubsetStorage of
+            buf_size instead of the full array.
+        dtype: dtype of the state, defaults to float (or complex for
+            complex y0).
+        args: extra arguments of right_side.
+        event: Event instance to detect threshold crossings and reset the
+            state, see events module. Terminal event makes the last record
+            at its time.
+        options: passed to the stepper, e.g. rtol and atol of dopri5, or
+            diffusion and rng of stochastic methods.
+    returns:
+        t: times of the records, array of shape (n_records,) or
+            SubsetStorage.
+        y: recorded states, array of shape (n_records,) + y0.shape or
+            SubsetStorage of them.
+        nfev: amount of right side evaluations. Other counters of the
+            stepper, e.g. naccept and nreject of dopri5 or nlu and nnewton
+            of backward_euler, are returned too.
+        t_events, i_events: times and indices of the events, if event was
+            given.
+        stats: stats of calls of right side, event functions and callback
+            options, see profile module. None outside of
+            profile.profiling().
+    """
+    y = _initial_state(y0, dtype)
+    return _run(method, right_side, y, t0, t1, dt, record_every, buf_size,
+                tuple(args), options, event=event)
+
+
+def integrate_ensemble(right_side, y0, t0, t1, dt, params=(), done=None,
+                       method='rk4', record_every=1, buf_size=None,
+                       dtype=None, **options):
+    """Integrates an ensemble of independent copies of the same model.
+
+    Same as integrate, but the first dimension of the state enumerates
+    members and right_side gets all of them at once. Members, for which done
+    returns True, are frozen and excluded from further right side calls.
+    Adaptive methods use a common step for all members.
+
+    parameters:
+        right_side: right_side(t, y, out, *params), y and out are
+            (n_members, ...) arrays of the active members. Their order may
+            differ from y0, params are always reordered alongside.
+        y0: initial states, array-like of shape (n_members, ...).
+        params: per-member parameters, arrays with the first dimension
+            n_members.
+        done: done(t, y, *params) returns boolean array of shape (m,) marking
+            members that finished. Checked after every step. None to never
+            finish.
+        other parameters are the same as in integrate, events are not
+            supported.
+    returns:
+        the same as integrate, y in the order of y0, and
+        t_done: time every member finished at, nan if it did not.
+    """
+    y = _initial_state(y0, dtype)
+    members = _Members(y, params, done)
+    res = _run(method, right_side, y, t0, t1, dt, record_every, buf_size,
+               members.args, options, members)
+    res['t_done'] = members.t_done
+    return res
+
+
+def test():
+    from .fixed import euler, rk4
+
+    def oscillator(t, y, out):
+        out[0] = y[1]
+        out[1] = -y[0]
+
+    # in-place steppers agree with the list-based steps
+    for stepper, step in [(EulerStepper(2), euler), (RK4Stepper(2), rk4)]:
+        prev = [1., 0.]
+        y = numpy.array(prev)
+        for i in range(100):
+            prev = step(prev, lambda t, a, b: numpy.array([b, -a]), i*0.01,
+                        0.01)
+            stepper.step(y, oscillator, i*0.01, 0.01)
+        assert numpy.allclose(prev, y, 0, 1e-12)
+    assert numpy.allclose(y, [numpy.cos(1.), -numpy.sin(1.)], 0, 1e-9)
+
+    exact = [numpy.cos(10.), -numpy.sin(10.)]
+    methods = [('euler', 0.1), ('rk4', 1e-6)]
+    methods.append(('dopri5', 1e-5))
+    for method, tol in methods:
+        res = integrate(oscillator, [1., 0.], 0., 10., 0.001, method,
+                        record_every=100)
+        error = numpy.abs(res['y'][-1] - exact).max()
+        print(method, len(res['t']), error)
+        assert len(res['t']) == 101 and error < tol, method
+
+    res = integrate(oscillator, [1., 0.], 0., 10., 0.001, buf_size=10)
+    assert len(res['y']) == 10 and numpy.allclose(res['y'][-1], exact)
+
+    # ensemble with per-member decay rates, finished members are frozen
+    def decay(t, y, out, k):
+        out[...] = -k[:, None] * y
+
+    def done(t, y, k):
+        return y[:, 0] < 0.5
+
+    k = numpy.array([2., 0.1, 0.5, 1.])
+    for method in ['rk4', 'dopri5']:
+        res = integrate_ensemble(decay, numpy.ones((4, 2)), 0., 5., 0.01,
+                                 [k], done, method)
+        finished = ~numpy.isnan(res['t_done'])
+        assert list(finished) == [True, False, True, True], method
+        t_end = numpy.where(finished, res['t_done'], 5.)
+        assert numpy.allclose(res['y'][-1][:, 0], numpy.exp(-k * t_end),
+                              1e-5), method
+
+    # per-member tolerances are reordered with their members
+    stepper = DormandPrinceStepper((3, 1),
+                                   rtol=numpy.array([[1.], [2.], [3.]]))
+    stepper.resize(2, numpy.array([2, 0, 1]))
+    assert list(stepper.rtol.ravel()) == [3., 1.]
+    rtol = numpy.array([[1e-2], [1e-10], [1e-2], [1e-2]])
+    res = integrate_ensemble(decay, numpy.ones((4, 2)), 0., 5., 0.01, [k],
+                             done, 'dopri5', rtol=rtol)
+    assert numpy.allclose(res['y'][-1][1], numpy.exp(-0.5), 1e-8)
+
+    from .events import Event
+
+    # leaky integrate-and-fire neurons, interspike interval is 10*ln(3)
+    def lif(t, v, out):
+        out[...] = (1.5 - v) / 10.
+
+    def reset(t, v, idx):
+        v[idx] = 0.
+
+    event = Event(lambda t, v: v - 1., reset)
+    res = integrate(lif, numpy.zeros(3), 0., 100., 0.5, 'rk4', event=event)
+    isi = numpy.diff(res['t_events'][res['i_events'] == 0])
+    print('rk4 isi', isi[:3])
+    assert len(isi) == 8 and numpy.allclose(isi, 10*numpy.log(3), 0, 0.5)
+    # adaptive steps are cut at the events
+    res = integrate(lif, numpy.zeros(3), 0., 100., 0.5, 'dopri5',
+                    event=event)
+    isi = numpy.diff(res['t_events'][res['i_events'] == 0])
+    print('dopri5 isi', isi[:3])
+    assert len(isi) == 8 and numpy.allclose(isi, 10*numpy.log(3), 0, 1e-3)
+    # events of the previous run are not reported again
+    res = integrate(lambda t, v, out: out.fill(0.), numpy.zeros(3), 0., 10.,
+                    0.5, event=event)
+    assert not len(res['t_events'])
+
+    event = Event(lambda t, v: v - 1., terminal=True)
+    res = integrate(lif, numpy.zeros(1), 0., 100., 0.5, 'dopri5',
+                    event=event)
+    assert abs(res['t'][-1] - 10*numpy.log(3)) < 1e-3
+
+    # stiff linear chain, Jacobian and its LU are computed once
+    from scipy import sparse
+
+    n = 20
+    J = 1000. * (numpy.eye(n, k=-1) - numpy.eye(n))
+
+    def chain(t, y, out):
+        numpy.dot(J, y, out=out)
+
+    y0 = numpy.zeros(n)
+    y0[0] = 1.
+    expected = numpy.linalg.matrix_power(
+        numpy.linalg.inv(numpy.eye(n) - 0.01*J), 100).dot(y0)
+    for options in [{}, {'jac': lambda t, y: J}, {'band': (1, 0)},
+                    {'jac_sparsity': sparse.csr_matrix(J != 0)}]:
+        res = integrate(chain, y0, 0., 1., 0.01, 'backward_euler',
+                        record_every=100, **options)
+        assert res['nlu'] == 1 and res['njev'] == 1, options
+        assert numpy.allclose(res['y'][-1], expected, 1e-5, 1e-12), options
+
+    # finished members shrink the Jacobian and its pattern
+    stepper = BackwardEulerStepper(3, jac_sparsity=[[1, 0, 0], [0, 0, 0],
+                                                    [1, 0, 0]])
+    stepper.resize(2, numpy.array([2, 0, 1]))
+    assert list(stepper._jac_rows) == [0, 1]
+    assert list(stepper._jac_cols) == [1, 1]
+
+    def decay1(t, y, out, k):
+        out[...] = -k * y
+
+    for options in [{}, {'band': (0, 0)}]:
+        res = integrate_ensemble(decay1, numpy.ones(4), 0., 5., 0.01, [k],
+                                 lambda t, y, k: y < 0.5, 'backward_euler',
+                                 **options)
+        finished = ~numpy.isnan(res['t_done'])
+        assert list(finished) == [True, False, True, True], options
+        steps = numpy.round(numpy.where(finished, res['t_done'], 5.) / 0.01)
+        assert numpy.allclose(res['y'][-1], (1. + 0.01*k)**-steps, 1e-5)
+
+    # linear part is propagated exactly
+    res = integrate(None, [1., 0.], 0., 10., 0.001, 'exponential',
+                    record_every=100, A=[[0., 1.], [-1., 0.]])
+    assert numpy.abs(res['y'][-1] - exact).max() < 1e-10
+    # y' = -y + cos(t), second order
+    for order, tol in [(1, 1e-2), (2, 1e-4)]:
+        res = integrate(lambda t, y, out: out.fill(numpy.cos(t)), [0.], 0.,
+                        1., 0.01, 'exponential', A=-1., order=order)
+        solution = (numpy.cos(1.) + numpy.sin(1.) - numpy.exp(-1.)) / 2
+        assert abs(res['y'][-1, 0] - solution) < tol, order
+    # per-component diagonal A of a 2-D state
+    A = -numpy.arange(1., 7.).reshape(2, 3)
+    res = integrate(None, numpy.ones((2, 3)), 0., 1., 0.1, 'exponential',
+                    A=A)
+    assert numpy.allclose(res['y'][-1], numpy.exp(A))
+    # square A acts densely on every member unless told otherwise
+    A = numpy.array([[-1., 2.], [-2., -1.]])
+    c, s = numpy.cos(2.), numpy.sin(2.)
+    res = integrate_ensemble(None, numpy.ones((2, 2)), 0., 1., 0.01,
+                             method='exponential', A=A)
+    assert numpy.allclose(res['y'][-1], numpy.exp(-1.) * numpy.array(
+        [c + s, c - s]))
+    res = integrate_ensemble(None, numpy.ones((2, 2)), 0., 1., 0.01,
+                             method='exponential', A=A, diagonal=True)
+    assert numpy.allclose(res['y'][-1], numpy.exp(A))
+
+    # noise does not depend on the block size
+    def relax(t, y, out):
+        numpy.negative(y, out=out)
+
+    paths = [integrate(relax, numpy.zeros(3), 0., 1., 0.01,
+                       'euler_maruyama', diffusion=0.5, rng=1,
+                       block_size=size)['y'] for size in (7, 1000)]
+    assert numpy.array_equal(paths[0], paths[1])
+
+    # strong order on geometric Brownian motion dy = y*dt + y*dW
+    def drift(t, y, out):
+        out[...] = y
+
+    def diffusion(t, y, out):
+        out[...] = y
+
+    errors = {}
+    for method in ['euler_maruyama', 'milstein']:
+        for n in [16, 256]:
+            res = integrate(drift, numpy.ones(2000), 0., 1., 1./n, method,
+                            record_every=n, diffusion=diffusion, rng=2)
+            w = numpy.random.default_rng(2).standard_normal((n, 2000))
+            w = w.sum(axis=0) / numpy.sqrt(n)
+            exact_y = numpy.exp(0.5 + w)
+            errors[method, n] = numpy.abs(res['y'][-1] - exact_y).mean()
+        order = numpy.log(errors[method, 16] / errors[method, 256])
+        order /= numpy.log(16.)
+        print(method, 'strong order', order)
+        assert (0.8 < order < 1.2) == (method == 'milstein'), method
+
+    # per-member additive noise and linear parts in ensembles
+    g = numpy.array([[0.], [1.], [0.], [2.]])
+    res = integrate_ensemble(decay, numpy.ones((4, 2)), 0., 5., 0.01, [k],
+                             done, 'euler_maruyama', diffusion=g, rng=1)
+    ref = integrate_ensemble(decay, numpy.ones((4, 2)), 0., 5., 0.01, [k],
+                             done, 'euler')
+    assert numpy.array_equal(res['y'][-1][[0, 2]], ref['y'][-1][[0, 2]])
+    A = -numpy.repeat([[1.], [2.], [3.], [4.]], 2, axis=1)
+    res = integrate_ensemble(None, numpy.zeros((4, 2)), 0., 5., 0.01, [k],
+                             lambda t, y, k: t >= 2. * k, 'exponential',
+                             A=A, b=-A)
+    t_end = numpy.where(numpy.isnan(res['t_done']), 5., res['t_done'])
+    assert numpy.allclose(res['y'][-1], 1. - numpy.exp(A * t_end[:, None]))
+    assert numpy.allclose(res['t_done'], 2. * k, 0, 0.011)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,220 @@
+"""Event detection and state reset for the integration drivers.
+
+Events are zero crossings of a vectorized function of the state, e.g.
+membrane potentials of a population crossing the threshold. Every crossing
+is located inside the step it happened in and recorded as (time, index).
+"""
+import numpy
+
+from .. import profile
+
+
+def _crossed(ga, gb, direction):
+    """Boolean mask of zero crossings between ga and gb."""
+    if direction > 0:
+        return (ga < 0) & (gb >= 0)
+    if direction < 0:
+        return (ga > 0) & (gb <= 0)
+    return ((ga < 0) & (gb >= 0)) | ((ga > 0) & (gb <= 0))
+
+
+class Event(object):
+    """Vectorized event detection with reset, refractoriness and termination.
+
+    Pass an instance to integrate as event. After the run t_events and
+    i_events hold times and indices of all detected events in the order they
+    were detected.
+
+    parameters:
+        func: func(t, y, *args) returns array of shape (k,). Event with index
+            i happens when func(t, y)[i] crosses zero.
+        reset: reset(t, y, idx) changes y in place after events with indices
+            idx. None to keep the state as is.
+        direction: 1 to detect crossings from negative values, -1 from
+            positive ones, 0 for both.
+        refractory: time after an event, during which its index can not fire
+            again and reset is reapplied after every step, e.g. to hold the
+            membrane potential at the reset value.
+        terminal: stops the integration at the first event.
+        refine, depth: the step is split into refine parts and the part
+            with the crossing is split again, depth times. State inside the
+            step is interpolated, crossing time is linearly interpolated
+            inside the last part. refine=1 means linear interpolation of func
+            between the ends of the step.
+
+    Attributes:
+    t_events: times of the events, float array.
+    i_events: indices of the events, int array.
+    """
+    def __init__(self, func, reset=None, direction=1, refractory=0.,
+                 terminal=False, refine=4, depth=2):
+        self.func = func
+        self.reset = reset
+        self.direction = direction
+        self.refractory = refractory
+        self.terminal = terminal
+        self.refine = refine
+        self.depth = depth
+        self.t_events = numpy.empty(0)
+        self.i_events = numpy.empty(0, numpy.intp)
+
+    def start(self, t, y, args=(), dense=None):
+        """Prepares detection for a run starting at (t, y).
+
+        dense(t, out) interpolates the state inside the last step. If None,
+        cubic Hermite interpolation is used and save() must be called before
+        every step. func and reset are timed by the active profiler.
+        """
+        self._func = profile.wrap(self.func, 'event_func')
+        self._reset = profile.wrap(self.reset, 'event_reset')
+        self._gold = numpy.array(self._func(t, y, *args), float)
+        self._until = numpy.full(self._gold.shape, -numpy.inf)
+        self._dense = dense
+        self._yold = numpy.empty_like(y)
+        self._ytmp = numpy.empty_like(y)
+        self._ysub = numpy.empty_like(y)
+        if dense is None:
+            self._f0 = numpy.empty_like(y)
+            self._f1 = numpy.empty_like(y)
+        self._times = numpy.empty(64)
+        self._index = numpy.empty(64, numpy.intp)
+        self._n = 0
+        self.t_events = self._times[:0]
+        self.i_events = self._index[:0]
+
+    def get_state(self):
+        """Picklable state of a run to continue it later with set_state."""
+        return {'gold': self._gold.copy(), 'until': self._until.copy(),
+                't_events': self.t_events.copy(),
+                'i_events': self.i_events.copy()}
+
+    def set_state(self, state):
+        """Restores state of a run, after start."""
+        self._gold[...] = state['gold']
+        self._until[...] = state['until']
+        self._n = 0
+        self._record(state['t_events'], state['i_events'])
+
+    def save(self, y):
+        """Remembers the state before a step for Hermite interpolation."""
+        self._yold[...] = y
+
+    def _hermite(self, t, out):
+        """Cubic Hermite interpolation inside the last step."""
+        x = (t - self._t0) / self._h
+        x2 = x * x
+        x3 = x2 * x
+        out[...] = self._yold
+        out *= 2*x3 - 3*x2 + 1
+        numpy.multiply(self._f0, self._h*(x3 - 2*x2 + x), out=self._ytmp)
+        out += self._ytmp
+        numpy.multiply(self._y, -2*x3 + 3*x2, out=self._ytmp)
+        out += self._ytmp
+        numpy.multiply(self._f1, self._h*(x3 - x2), out=self._ytmp)
+        out += self._ytmp
+        return out
+
+    def _record(self, t, idx):
+        n = self._n + len(idx)
+        if n > len(self._times):
+            size = max(n, 2 * len(self._times))
+            self._times = numpy.resize(self._times, size)
+            self._index = numpy.resize(self._index, size)
+        self._times[self._n:n] = t
+        self._index[self._n:n] = idx
+        self._n = n
+        self.t_events = self._times[:n]
+        self.i_events = self._index[:n]
+
+    def _locate(self, idx, g, t, t_new, args):
+        """Times of crossings of idx inside [t, t_new].
+
+        Every level splits the parts containing crossings into refine parts
+        again, so amount of func calls does not depend on amount of events.
+        """
+        n = self.refine
+        m = len(idx)
+        cols = numpy.arange(m)
+        lo = numpy.full(m, float(t))
+        width = t_new - t
+        glo = self._gold[idx]
+        ghi = g[idx]
+        gs = numpy.empty((n + 1, m))
+        for _ in range(self.depth):
+            width /= n
+            gs[0] = glo
+            gs[n] = ghi
+            starts, inverse = numpy.unique(lo, return_inverse=True)
+            for j in range(1, n):
+                for u, start in enumerate(starts):
+                    tj = start + j*width
+                    self._interpolate(tj, self._ysub)
+                    gj = numpy.asarray(self._func(tj, self._ysub, *args))[idx]
+                    if len(starts) == 1:
+                        gs[j] = gj
+                    else:
+                        part = inverse == u
+                        gs[j, part] = gj[part]
+            j = numpy.argmax(_crossed(gs[:-1], gs[1:], self.direction), axis=0)
+            lo += j * width
+            glo = gs[j, cols]
+            ghi = gs[j + 1, cols]
+        return lo + width * glo / (glo - ghi)
+
+    def check(self, t, t_new, y, right_side, args=(), stepper=None):
+        """Detects events of the step from t to t_new and resets y.
+
+        right_side and stepper are used for interpolation, stepper is also
+        told when y was changed. Returns time of the terminal event, or, if
+        dense output of an adaptive stepper was given to start, time of the
+        earliest event with reset. The step is cut there: only events at
+        that time are recorded and y is set to the interpolated (and reset)
+        state at it, later crossings are found again by the next steps.
+        Returns None if the step was not cut.
+        """
+        g = numpy.asarray(self._func(t_new, y, *args), float)
+        crossed = _crossed(self._gold, g, self.direction)
+        if self.refractory:
+            crossed &= self._until <= t_new
+        idx = numpy.flatnonzero(crossed)
+        changed = False
+        cut = None
+        if len(idx):
+            if self._dense is None:
+                self._t0, self._h, self._y = t, t_new - t, y
+                right_side(t, self._yold, self._f0, *args)
+                right_side(t_new, y, self._f1, *args)
+                if stepper is not None:
+                    stepper.nfev += 2
+                self._interpolate = self._hermite
+            else:
+                self._interpolate = self._dense
+            times = self._locate(idx, g, t, t_new, args)
+            if self.terminal or (self.reset is not None and
+                                 self._dense is not None):
+                t_ev = times.min()
+                first = times == t_ev
+                times, idx = times[first], idx[first]
+                self._interpolate(t_ev, self._ysub)
+                y[...] = self._ysub
+                t_new = cut = t_ev
+                if self.terminal:
+                    self._record(times, idx)
+                    return t_ev
+            self._record(times, idx)
+            if self.refractory:
+                self._until[idx] = times + self.refractory
+            if self.reset is not None:
+                self._reset(t_new, y, idx)
+                changed = True
+        if self.refractory and self.reset is not None:
+            held = numpy.flatnonzero(self._until > t_new)
+            if len(held):
+                self._reset(t_new, y, held)
+                changed = True
+        if changed:
+            g = numpy.asarray(self._func(t_new, y, *args), float)
+            if stepper is not None and self._dense is not None:
+                stepper.reset()
+        self._gold = g
+        return cut
@@ -0,0 +1,136 @@
+"""Exponential integration of y' = A*y + b + g(t, y).
+
+Linear part is integrated exactly through the propagator exp(dt*A) and the
+phi-functions of dt*A, which are computed once per dt and cached. Each step
+is then a few elementwise (diagonal A) or matrix-vector (dense A) operations
+plus the nonlinear term g. Dense A requires scipy, imported on first use.
+"""
+import numpy
+
+from .fixed import Stepper
+
+
+def _phi_diagonal(a, dt, order):
+    """exp(dt*a), dt*phi1(dt*a), ..., dt*phi_order(dt*a) of diagonal a."""
+    z = dt * a
+    small = numpy.abs(z) < 1e-3
+    zs = numpy.where(small, 1., z)
+    phi1 = numpy.where(small, 1. + z/2 + z*z/6, numpy.expm1(zs) / zs)
+    res = [numpy.exp(z), dt * phi1]
+    if order > 1:
+        phi2 = numpy.where(small, 0.5 + z/6 + z*z/24, (phi1 - 1.) / zs)
+        res.append(dt * phi2)
+    return res
+
+
+def _phi_dense(A, dt, order):
+    """Same as _phi_diagonal for dense A.
+
+    All of them are blocks of one augmented matrix exponential. Returned
+    transposed, for right multiplication of the state.
+    """
+    from scipy.linalg import expm
+
+    n = len(A)
+    M = numpy.zeros(((order + 1) * n,) * 2, numpy.result_type(A, float))
+    M[:n, :n] = dt * A
+    for i in range(order):
+        M[i*n:(i+1)*n, (i+1)*n:(i+2)*n] = numpy.identity(n)
+    eM = expm(M)
+    res = [eM[:n, :n]]
+    for i in range(1, order + 1):
+        res.append(dt * eM[:n, i*n:(i+1)*n])
+    return [numpy.ascontiguousarray(r.T) for r in res]
+
+
+class ExponentialStepper(Stepper):
+    """Exponential Euler (order=1) or ETD2RK (order=2) step.
+
+    Right side gives only the nonlinear part, right_side(t, y, out, *args)
+    writes g(t, y) into out, and may be None for purely linear systems.
+
+    parameters:
+        n, dtype: see Stepper.
+        A: linear part. Scalar or array broadcastable to the state for
+            diagonal A, (k, k) matrix acting on the last axis of the state
+            for dense A.
+        b: constant term, scalar or array broadcastable to the state.
+        order: 1 for exponential Euler, 2 for second order exponential
+            Runge-Kutta of Cox and Matthews, which calls right side twice.
+        diagonal: False for dense A. If None, A is dense if its shape is
+            (k, k), k being the last axis of the state. Per-member
+            diagonal A of that shape needs diagonal=True.
+    """
+    stages = ('g', 'g2', 'ytmp', 'scratch')
+
+    def __init__(self, n, dtype=float, A=0., b=0., order=1, diagonal=None):
+        super(ExponentialStepper, self).__init__(n, dtype)
+        if order not in (1, 2):
+            raise ValueError('Order of ExponentialStepper is 1 or 2.')
+        self.A = numpy.asarray(A)
+        self.b = self._b_full = self._per_row(b)
+        self.order = order
+        k = self.shape[-1] if self.shape else 1
+        if diagonal is None:
+            diagonal = self.A.shape != (k, k)
+        elif not diagonal and self.A.shape != (k, k):
+            raise ValueError('Dense A must be a (%d, %d) matrix.' % (k, k))
+        self.diagonal = diagonal
+        if diagonal:
+            self.A = self._per_row(self.A)
+        self._A_full = self.A
+        self._cache = {}
+
+    def resize(self, m, order=None):
+        super(ExponentialStepper, self).resize(m, order)
+        self.b = self._rows(self._b_full, m, order)
+        if self.diagonal:
+            A = self._rows(self._A_full, m, order)
+            if A is not self._A_full:
+                # propagators of per-member A
+                self._cache = {}
+            self.A = A
+
+    def propagators(self, dt):
+        """[exp(dt*A), dt*phi1(dt*A)] and dt*phi2(dt*A) for order 2.
+
+        Matrices of dense A are transposed. Cached per dt.
+        """
+        if dt not in self._cache:
+            if self.diagonal:
+                self._cache[dt] = _phi_diagonal(self.A, dt, self.order)
+            else:
+                self._cache[dt] = _phi_dense(self.A, dt, self.order)
+        return self._cache[dt]
+
+    def _apply(self, P, x, out):
+        """out = P*x for diagonal or x @ P for transposed dense P."""
+        if self.diagonal:
+            numpy.multiply(x, P, out=out)
+        else:
+            numpy.matmul(x, P, out=out)
+        return out
+
+    def _nonlinear(self, right_side, t, y, out, args):
+        """out = b + g(t, y)."""
+        if right_side is None:
+            out.fill(0)
+        else:
+            right_side(t, y, out, *args)
+            self.nfev += 1
+        out += self.b
+        return out
+
+    def step(self, y, right_side, t, dt, args=()):
+        props = self.propagators(dt)
+        E, P1 = props[0], props[1]
+        g, ytmp, scratch = self.g, self.ytmp, self.scratch
+        self._nonlinear(right_side, t, y, g, args)
+        self._apply(E, y, ytmp)
+        ytmp += self._apply(P1, g, scratch)
+        if self.order > 1:
+            g2 = self._nonlinear(right_side, t + dt, ytmp, self.g2, args)
+            g2 -= g
+            ytmp += self._apply(props[2], g2, scratch)
+        y[...] = ytmp
+        return y
@@ -0,0 +1,166 @@
+"""Fixed-step integration steps.
+
+euler and rk4 are simple list-based steps. EulerStepper and RK4Stepper do the
+same on numpy arrays in place, keeping all intermediate stages in
+preallocated buffers, so there is no allocation per step. Their right side
+has the form right_side(t, y, out) and must write dy/dt into out.
+"""
+import numpy
+
+
+def _shape(n):
+    """Shape tuple from an int or a tuple."""
+    if numpy.ndim(n) == 0:
+        return (int(n),)
+    return tuple(int(i) for i in n)
+
+
+def _splat(right_side):
+    """Wraps right_side(t, *y) into right_side(t, y, out) form."""
+    def rhs(t, y, out):
+        out[...] = right_side(t, *y)
+    return rhs
+
+
+def _as_state(prev):
+    """Copies prev into a float (or complex) numpy array."""
+    y = numpy.array(prev)
+    return y.astype(numpy.result_type(y.dtype, float))
+
+
+class Stepper(object):
+    """Base class of in-place steppers.
+
+    Allocates one buffer of shape n and dtype per name in stages on creation.
+    Names in counters are integer statistics reported by the drivers.
+    Right side is called as right_side(t, y, out, *args).
+
+    Attributes:
+    shape: shape of the state.
+    dtype: dtype of the state.
+    nfev: amount of right side evaluations.
+    """
+    stages = ()
+    counters = ('nfev',)
+    adaptive = False
+
+    def __init__(self, n, dtype=float):
+        self.shape = _shape(n)
+        self.dtype = numpy.dtype(dtype)
+        self._nrows = self.shape[0] if self.shape else 1
+        for name in self.counters:
+            setattr(self, name, 0)
+        self._buffers = [numpy.empty(self.shape, self.dtype)
+                         for _ in self.stages]
+        for name, buf in zip(self.stages, self._buffers):
+            setattr(self, name, buf)
+
+    def resize(self, m, order=None):
+        """Makes stepper work on the first m rows of the state only.
+
+        Used by ensemble drivers to stop work on finished members. Buffers
+        become views, nothing is reallocated. order is the permutation of
+        the rows made by the driver, y[:len(order)] = y[order], per-row
+        options of the stepper are reordered the same way.
+        """
+        self.shape = (m,) + self._buffers[0].shape[1:]
+        for name, buf in zip(self.stages, self._buffers):
+            setattr(self, name, buf[:m])
+
+    def _per_row(self, x):
+        """x as an array, copied if it has a value for every row of the state.
+
+        Such arrays are reordered with the rows by _rows.
+        """
+        x = numpy.asarray(x)
+        if x.ndim and x.ndim == len(self.shape) and len(x) == self._nrows:
+            return numpy.array(x)
+        return x
+
+    def _rows(self, x, m, order):
+        """Reorders per-row x like the state, returns its first m rows."""
+        if not x.ndim or x.ndim != len(self.shape) or len(x) != self._nrows:
+            return x
+        if order is not None:
+            x[:len(order)] = x[order]
+        return x[:m]
+
+    def get_state(self):
+        """Picklable state to continue integration later with set_state.
+
+        Buffers and callables are not included.
+        """
+        return dict((name, getattr(self, name)) for name in self.counters)
+
+    def set_state(self, state):
+        for name in self.counters:
+            setattr(self, name, state[name])
+
+    def step(self, y, right_side, t, dt, args=()):
+        """Advances y from t to t+dt in place and returns it."""
+        raise NotImplementedError
+
+
+class EulerStepper(Stepper):
+    """Explicit Euler step on numpy arrays, see Stepper."""
+    stages = ('k1',)
+
+    def step(self, y, right_side, t, dt, args=()):
+        k1 = self.k1
+        right_side(t, y, k1, *args)
+        self.nfev += 1
+        k1 *= dt
+        y += k1
+        return y
+
+
+class RK4Stepper(Stepper):
+    """Classical Runge-Kutta step on numpy arrays, see Stepper.
+
+    k1..k4 hold the stages, ytmp holds the intermediate states.
+    """
+    stages = ('k1', 'k2', 'k3', 'k4', 'ytmp')
+
+    def step(self, y, right_side, t, dt, args=()):
+        k1, k2, k3, k4, ytmp = self.k1, self.k2, self.k3, self.k4, self.ytmp
+        right_side(t, y, k1, *args)
+        numpy.multiply(k1, dt/2, out=ytmp)
+        ytmp += y
+        right_side(t+dt/2, ytmp, k2, *args)
+        numpy.multiply(k2, dt/2, out=ytmp)
+        ytmp += y
+        right_side(t+dt/2, ytmp, k3, *args)
+        numpy.multiply(k3, dt, out=ytmp)
+        ytmp += y
+        right_side(t+dt, ytmp, k4, *args)
+        self.nfev += 4
+        # y += dt/6*(k1 + 2*k2 + 2*k3 + k4)
+        k2 += k3
+        k2 *= 2
+        k2 += k1
+        k2 += k4
+        k2 *= dt/6
+        y += k2
+        return y
+
+
+def euler(prev, right_side, t, dt):
+    """ right_side = right_side(t, *(y))
+        right_side: R^(t+len(prev)) -> R^len(prev)
+        Thin wrapper around EulerStepper.
+    """
+    y = _as_state(prev)
+    EulerStepper(y.shape, y.dtype).step(y, _splat(right_side), t, dt)
+    return list(y)
+
+
+def rk4(prev, right_side, t, dt):
+    """ right_side = right_side(t, *(y))
+        right_side: R^(t+len(prev)) -> R^len(prev)
+        right side MUST return an array
+        Thin wrapper around RK4Stepper.
+    """
+    y = _as_state(prev)
+    RK4Stepper(y.shape, y.dtype).step(y, _splat(right_side), t, dt)
+    return list(y)
+
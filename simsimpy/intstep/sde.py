@@ -0,0 +1,184 @@
+"""Stochastic integration of dy = f(t, y)*dt + g(t, y)*dW.
+
+Noise is diagonal: every component of the state has its own Wiener process.
+Increments are drawn from a numpy.random.Generator in large blocks by
+WienerIncrements. The generator fills blocks sequentially, so the sequence
+of increments for a given seed does not depend on the block size.
+"""
+import numpy
+
+from .fixed import Stepper
+
+
+class WienerIncrements(object):
+    """Serves standard normal samples of given shape drawn in blocks.
+
+    parameters:
+        rng: numpy.random.Generator, or a seed for numpy.random.default_rng.
+        shape: shape of one sample.
+        block_size: amount of samples drawn at once.
+
+    Attributes:
+    ndrawn: amount of samples served.
+    """
+    def __init__(self, rng, shape, block_size=1024):
+        self.rng = numpy.random.default_rng(rng)
+        self.shape = tuple(shape)
+        self.block_size = block_size
+        self.ndrawn = 0
+        self._block = numpy.empty((block_size,) + self.shape)
+        self._i = block_size
+        self._rng_state = None
+
+    def next(self):
+        """Next sample, a view into the block valid until the next call."""
+        if self._i == self.block_size:
+            self._rng_state = self.rng.bit_generator.state
+            self.rng.standard_normal(out=self._block)
+            self._i = 0
+        self._i += 1
+        self.ndrawn += 1
+        return self._block[self._i - 1]
+
+    def get_state(self):
+        """State to continue the same sequence later with set_state.
+
+        Consists of generator state at the start of the current block and
+        position in it, so the block itself is not stored.
+        """
+        if self._rng_state is None:
+            return {'rng': self.rng.bit_generator.state, 'i': None,
+                    'ndrawn': self.ndrawn}
+        return {'rng': self._rng_state, 'i': self._i, 'ndrawn': self.ndrawn}
+
+    def set_state(self, state):
+        self.rng.bit_generator.state = state['rng']
+        self.ndrawn = state['ndrawn']
+        if state['i'] is None:
+            self._i = self.block_size
+            self._rng_state = None
+        else:
+            self._rng_state = state['rng']
+            self.rng.standard_normal(out=self._block)
+            self._i = state['i']
+
+
+class EulerMaruyamaStepper(Stepper):
+    """Euler-Maruyama step with additive or diagonal multiplicative noise.
+
+    parameters:
+        n, dtype: see Stepper.
+        diffusion: g. Scalar or array broadcastable to the state for additive
+            noise, or diffusion(t, y, out, *args) writing g(t, y) into out.
+        rng: numpy.random.Generator or a seed.
+        block_size: amount of steps, for which increments are drawn at once.
+    """
+    stages = ('k1', 'gy', 'dw')
+
+    def __init__(self, n, dtype=float, diffusion=1., rng=None,
+                 block_size=1024):
+        super(EulerMaruyamaStepper, self).__init__(n, dtype)
+        self.additive = not callable(diffusion)
+        if self.additive:
+            diffusion = self._diffusion_full = self._per_row(diffusion)
+        self.diffusion = diffusion
+        self.noise = WienerIncrements(rng, self.shape, block_size)
+
+    def resize(self, m, order=None):
+        super(EulerMaruyamaStepper, self).resize(m, order)
+        if self.additive:
+            self.diffusion = self._rows(self._diffusion_full, m, order)
+
+    def get_state(self):
+        state = super(EulerMaruyamaStepper, self).get_state()
+        state['noise'] = self.noise.get_state()
+        return state
+
+    def set_state(self, state):
+        super(EulerMaruyamaStepper, self).set_state(state)
+        self.noise.set_state(state['noise'])
+
+    def _increments(self, dt):
+        """Writes Wiener increments of the step into dw."""
+        z = self.noise.next()
+        if len(z) != len(self.dw):
+            # resized for an ensemble
+            z = z[:len(self.dw)]
+        numpy.multiply(z, numpy.sqrt(dt), out=self.dw)
+        return self.dw
+
+    def _diffusion(self, t, y, args):
+        """Writes g(t, y) into gy, returns it or the constant."""
+        if self.additive:
+            return self.diffusion
+        self.diffusion(t, y, self.gy, *args)
+        return self.gy
+
+    def step(self, y, right_side, t, dt, args=()):
+        k1 = self.k1
+        dw = self._increments(dt)
+        g = self._diffusion(t, y, args)
+        right_side(t, y, k1, *args)
+        self.nfev += 1
+        k1 *= dt
+        dw *= g
+        y += k1
+        y += dw
+        return y
+
+
+class MilsteinStepper(EulerMaruyamaStepper):
+    """Milstein step for diagonal noise, see EulerMaruyamaStepper.
+
+    Adds 0.5*g*dg/dy*(dW**2 - dt) to Euler-Maruyama, which raises strong
+    order to 1 for multiplicative noise. Same as Euler-Maruyama for additive
+    noise.
+
+    parameters:
+        diffusion_derivative: diffusion_derivative(t, y, out, *args) writes
+            dg_i/dy_i into out. Estimated by finite differences if None.
+        other parameters are the same as in EulerMaruyamaStepper.
+    """
+    stages = ('k1', 'gy', 'dw', 'dg', 'ytmp')
+
+    def __init__(self, n, dtype=float, diffusion=1., rng=None,
+                 block_size=1024, diffusion_derivative=None):
+        super(MilsteinStepper, self).__init__(n, dtype, diffusion, rng,
+                                              block_size)
+        self.diffusion_derivative = diffusion_derivative
+
+    def _derivative(self, t, y, g, args):
+        """Writes dg/dy into dg."""
+        if self.diffusion_derivative is not None:
+            self.diffusion_derivative(t, y, self.dg, *args)
+            return self.dg
+        delta = numpy.sqrt(numpy.finfo(float).eps) * numpy.maximum(
+            1., numpy.abs(y))
+        numpy.add(y, delta, out=self.ytmp)
+        self.diffusion(t, self.ytmp, self.dg, *args)
+        self.dg -= g
+        self.dg /= delta
+        return self.dg
+
+    def step(self, y, right_side, t, dt, args=()):
+        if self.additive:
+            return super(MilsteinStepper, self).step(y, right_side, t, dt,
+                                                     args)
+        k1, ytmp = self.k1, self.ytmp
+        dw = self._increments(dt)
+        g = self._diffusion(t, y, args)
+        dg = self._derivative(t, y, g, args)
+        right_side(t, y, k1, *args)
+        self.nfev += 1
+        # ytmp = 0.5*g*dg*(dw**2 - dt)
+        numpy.multiply(dw, dw, out=ytmp)
+        ytmp -= dt
+        ytmp *= dg
+        ytmp *= g
+        ytmp *= 0.5
+        k1 *= dt
+        dw *= g
+        y += k1
+        y += dw
+        y += ytmp
+        return y
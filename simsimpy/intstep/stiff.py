@@ -0,0 +1,224 @@
+"""Implicit integration for stiff systems.
+
+BackwardEulerStepper solves the implicit Euler equation with simplified
+Newton iterations. Jacobian and LU factorisation of I - dt*J are kept between
+steps and recomputed only when Newton iterations stop converging or dt
+changes. Jacobian may be given analytically or estimated by finite
+differences, dense or sparse (e.g. banded). Requires scipy, which is
+imported on first use.
+"""
+import numpy
+
+from .fixed import Stepper
+
+
+def _group_columns(pattern):
+    """Splits columns of sparse pattern into groups without common rows.
+
+    Columns of one group can be perturbed together in finite differences.
+    Returns group number of every column and amount of groups.
+    """
+    pattern = pattern.tocsc()
+    n_rows, n_cols = pattern.shape
+    groups = numpy.empty(n_cols, numpy.intp)
+    used = []
+    for j in range(n_cols):
+        rows = pattern.indices[pattern.indptr[j]:pattern.indptr[j+1]]
+        for g, taken in enumerate(used):
+            if not taken[rows].any():
+                break
+        else:
+            g = len(used)
+            used.append(numpy.zeros(n_rows, bool))
+        used[g][rows] = True
+        groups[j] = g
+    return groups, len(used)
+
+
+class BackwardEulerStepper(Stepper):
+    """Implicit Euler step with Jacobian and LU reuse.
+
+    State must be one-dimensional. If Newton iterations fail even with a
+    fresh Jacobian, the step is split in halves.
+
+    parameters:
+        n, dtype: see Stepper.
+        jac: jac(t, y, *args) returns the Jacobian of the right side, dense
+            array or scipy.sparse matrix. Estimated by finite differences if
+            None.
+        jac_sparsity: sparsity pattern of the Jacobian, array or
+            scipy.sparse matrix, for finite differences. Columns without
+            common rows are estimated with one right side call.
+        band: (lower, upper) bandwidths of the Jacobian, shortcut for banded
+            jac_sparsity.
+        rtol, atol: tolerances of Newton iterations.
+        max_newton: maximal amount of Newton iterations per step.
+        max_split: maximal depth of step splitting.
+
+    Attributes:
+    njev: amount of Jacobian evaluations.
+    nlu: amount of LU factorisations.
+    nnewton: amount of Newton iterations.
+    """
+    stages = ('z', 'f', 'res', 'ytmp')
+    counters = ('nfev', 'njev', 'nlu', 'nnewton')
+
+    def __init__(self, n, dtype=float, jac=None, jac_sparsity=None, band=None,
+                 rtol=1e-6, atol=1e-9, max_newton=6, max_split=10):
+        super(BackwardEulerStepper, self).__init__(n, dtype)
+        if len(self.shape) != 1:
+            raise ValueError('State of BackwardEulerStepper must be 1-D.')
+        from scipy import sparse
+
+        size = self.shape[0]
+        if band is not None:
+            lower, upper = band
+            jac_sparsity = sparse.diags(
+                [numpy.ones(size - abs(k)) for k in range(-lower, upper+1)],
+                list(range(-lower, upper+1)), shape=(size, size))
+        if jac_sparsity is not None:
+            self._pattern = sparse.csc_matrix(jac_sparsity)
+            self._members = numpy.arange(size)
+            self._set_pattern(self._pattern)
+        self.jac = jac
+        self.sparse = jac_sparsity is not None
+        self.rtol = rtol
+        self.atol = atol
+        self.max_newton = max_newton
+        self.max_split = max_split
+        self.J = None
+        self._fresh = False
+        self._lu = None
+        self._lu_dt = None
+
+    def _set_pattern(self, pattern):
+        """Nonzero entries and column groups of the sparsity pattern."""
+        self._jac_rows, self._jac_cols = pattern.nonzero()
+        self._groups, self._ngroups = _group_columns(pattern)
+
+    def resize(self, m, order=None):
+        super(BackwardEulerStepper, self).resize(m, order)
+        if hasattr(self, '_pattern'):
+            if order is not None:
+                self._members[:len(order)] = self._members[order]
+            rows = self._members[:m]
+            self._set_pattern(self._pattern[rows][:, rows])
+        self.J = None
+        self._fresh = False
+        self._lu = None
+
+    def get_state(self):
+        state = super(BackwardEulerStepper, self).get_state()
+        state['J'] = self.J
+        state['sparse'] = self.sparse
+        return state
+
+    def set_state(self, state):
+        super(BackwardEulerStepper, self).set_state(state)
+        self.J = state['J']
+        self.sparse = state['sparse']
+        self._fresh = False
+        self._lu = None
+
+    def _jacobian(self, t, y, right_side, args):
+        """Evaluates the Jacobian at (t, y)."""
+        from scipy import sparse
+
+        self.njev += 1
+        if self.jac is not None:
+            J = self.jac(t, y, *args)
+            self.sparse = sparse.issparse(J)
+            return sparse.csc_matrix(J) if self.sparse else numpy.asarray(J)
+        f0, ytmp, fd = self.f, self.ytmp, self.res
+        right_side(t, y, f0, *args)
+        self.nfev += 1
+        delta = numpy.sqrt(numpy.finfo(float).eps) * numpy.maximum(
+            1., numpy.abs(y))
+        if not self.sparse:
+            J = numpy.empty(self.shape * 2, self.dtype)
+            for j in range(self.shape[0]):
+                ytmp[...] = y
+                ytmp[j] += delta[j]
+                right_side(t, ytmp, fd, *args)
+                J[:, j] = (fd - f0) / delta[j]
+            self.nfev += self.shape[0]
+            return J
+        rows, cols, groups = self._jac_rows, self._jac_cols, self._groups
+        values = numpy.empty(len(rows), self.dtype)
+        for g in range(self._ngroups):
+            ytmp[...] = y
+            perturbed = groups == g
+            ytmp[perturbed] += delta[perturbed]
+            right_side(t, ytmp, fd, *args)
+            entries = perturbed[cols]
+            values[entries] = ((fd[rows[entries]] - f0[rows[entries]]) /
+                               delta[cols[entries]])
+        self.nfev += self._ngroups
+        return sparse.csc_matrix((values, (rows, cols)), shape=self.shape*2)
+
+    def _factorize(self, dt):
+        """LU factorisation of I - dt*J."""
+        from scipy import linalg, sparse
+        from scipy.sparse.linalg import splu
+
+        self.nlu += 1
+        if self.sparse:
+            lu = splu(sparse.identity(self.shape[0], self.dtype, 'csc') -
+                      dt * self.J)
+            self._lu = lu.solve
+        else:
+            lu = linalg.lu_factor(numpy.identity(self.shape[0], self.dtype) -
+                                  dt * self.J, check_finite=False)
+            self._lu = lambda b: linalg.lu_solve(lu, b, check_finite=False)
+        self._lu_dt = dt
+
+    def _newton(self, y, right_side, t, dt, args):
+        """Solves z = y + dt*f(t+dt, z) into self.z, returns success."""
+        z, f, res = self.z, self.f, self.res
+        z[...] = y
+        scale = self.atol + self.rtol * numpy.abs(y)
+        norm_old = None
+        for _ in range(self.max_newton):
+            right_side(t + dt, z, f, *args)
+            self.nfev += 1
+            self.nnewton += 1
+            # res = y + dt*f - z
+            numpy.multiply(f, dt, out=res)
+            res += y
+            res -= z
+            dz = self._lu(res)
+            z += dz
+            norm = numpy.sqrt(numpy.mean((dz / scale)**2))
+            if norm_old is not None:
+                rate = norm / norm_old
+                if rate >= 1.:
+                    return False
+                if rate / (1. - rate) * norm < 1.:
+                    return True
+            elif norm < 1e-3:
+                return True
+            norm_old = norm
+        return False
+
+    def step(self, y, right_side, t, dt, args=(), split=0):
+        if self.J is None:
+            self.J = self._jacobian(t, y, right_side, args)
+            self._fresh = True
+        if self._lu is None or self._lu_dt != dt:
+            self._factorize(dt)
+        while not self._newton(y, right_side, t, dt, args):
+            if not self._fresh:
+                # convergence degraded, recompute the Jacobian
+                self.J = self._jacobian(t, y, right_side, args)
+                self._fresh = True
+                self._factorize(dt)
+                continue
+            if split >= self.max_split:
+                raise RuntimeError('Newton iterations did not converge at '
+                                   't = %g.' % t)
+            self.step(y, right_side, t, dt/2, args, split+1)
+            self.step(y, right_side, t + dt/2, dt/2, args, split+1)
+            return y
+        y[...] = self.z
+        self._fresh = False
+        return y
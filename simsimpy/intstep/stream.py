@@ -0,0 +1,191 @@
+"""Chunked integration output for long runs.
+
+integrate_chunks yields records in chunks of fixed size instead of keeping
+the whole trajectory in memory. integrate_to_file writes the chunks straight
+into a memory-mapped .npy file and periodically checkpoints the integrator,
+so an interrupted run can be resumed from the last checkpoint.
+"""
+import os
+import pickle
+
+import numpy
+
+from .. import profile
+from .driver import _counters, _initial_state, _records
+
+
+def _chunked(records, chunk_size, shape, dtype):
+    """Groups records into (times, states) arrays of chunk_size records.
+
+    Arrays are reused between chunks, the last one may be shorter.
+    """
+    times = numpy.empty(chunk_size)
+    states = numpy.empty((chunk_size,) + shape, dtype)
+    n = 0
+    for t, y in records:
+        times[n] = t
+        states[n] = y
+        n += 1
+        if n == chunk_size:
+            yield times, states
+            n = 0
+    if n:
+        yield times[:n], states[:n]
+
+
+def integrate_chunks(right_side, y0, t0, t1, dt, chunk_size=1024,
+                     method='rk4', record_every=1, dtype=None, args=(),
+                     event=None, **options):
+    """Generator version of integrate, yields records chunk by chunk.
+
+    Yields (t, y) arrays of shapes (chunk_size,) and (chunk_size,) +
+    y0.shape, the last chunk may be shorter. The arrays are reused, copy them
+    to keep. Parameters are the same as in integrate.
+    """
+    y = _initial_state(y0, dtype)
+    records = _records(method, right_side, y, t0, t1, dt, record_every,
+                       tuple(args), options, event=event)[2]
+    for chunk in _chunked(records, chunk_size, y.shape, y.dtype):
+        yield chunk
+
+
+def _save_checkpoint(filename, state):
+    """Writes checkpoint atomically, so a crash leaves the previous one."""
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, filename)
+
+
+def integrate_to_file(filename, right_side, y0, t0, t1, dt, chunk_size=1024,
+                      checkpoint_every=16, checkpoint=None, resume=False,
+                      method='rk4', record_every=1, dtype=None, args=(),
+                      event=None, **options):
+    """Integrates into a memory-mapped .npy file with checkpoints.
+
+    File holds a structured array of all records with fields 't' and 'y'.
+    Only one chunk of records is kept in memory. After every checkpoint_every
+    chunks the file is flushed and the state of the run (records written,
+    current state, stepper counters, random generator and event state) is
+    saved to checkpoint. With resume=True an existing checkpoint is loaded
+    and integration continues from it. Fixed-step methods continue exactly
+    as the interrupted run would, adaptive ones restart from the last record.
+
+    parameters:
+        filename: .npy file for the records.
+        chunk_size: amount of records written at once.
+        checkpoint_every: amount of chunks between checkpoints.
+        checkpoint: checkpoint file, defaults to filename + '.ckpt'.
+        resume: continue from the checkpoint if it exists. A finished run
+            is not repeated.
+        other parameters are the same as in integrate. right_side, options
+            and event must be the same when resuming.
+    returns:
+        t: times of the records, read-only memory-mapped array.
+        y: recorded states, read-only memory-mapped array.
+        counters, events and stats, same as in integrate.
+    """
+    if checkpoint is None:
+        checkpoint = filename + '.ckpt'
+    mark = profile.mark()
+    right_side = profile.wrap(right_side, 'right_side')
+    y = _initial_state(y0, dtype)
+    state = None
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint, 'rb') as f:
+            state = pickle.load(f)
+        y[...] = state['y']
+    first = 0 if state is None else state['records'] - 1
+    stepper, n_records, records = _records(
+        method, right_side, y, t0, t1, dt, record_every, tuple(args), options,
+        event=event, first=first)
+    record = numpy.dtype([('t', float), ('y', y.dtype, y.shape)])
+
+    if state is None:
+        out = numpy.lib.format.open_memmap(filename, 'w+', record,
+                                           (n_records,))
+        written = 0
+    elif state['done']:
+        stepper.set_state(state['stepper'])
+        if event is not None:
+            next(records)
+            event.set_state(state['event'])
+        out = None
+        written = state['records']
+    else:
+        out = numpy.load(filename, mmap_mode='r+')
+        stepper.set_state(state['stepper'])
+        # record the run was stopped at is already in the file
+        next(records)
+        if event is not None:
+            event.set_state(state['event'])
+        written = state['records']
+
+    def save(done=False):
+        out.flush()
+        _save_checkpoint(checkpoint, {
+            'records': written, 'y': y_last.copy(), 'done': done,
+            'stepper': stepper.get_state(),
+            'event': None if event is None else event.get_state()})
+
+    if out is not None:
+        y_last = out['y'][written - 1] if written else y
+        for i, (times, states) in enumerate(
+                _chunked(records, chunk_size, y.shape, y.dtype)):
+            out['t'][written:written + len(times)] = times
+            out['y'][written:written + len(times)] = states
+            written += len(times)
+            y_last = states[-1]
+            if (i + 1) % checkpoint_every == 0:
+                save()
+        save(done=True)
+
+    res = numpy.load(filename, mmap_mode='r')[:written]
+    res = _counters({'t': res['t'], 'y': res['y']}, stepper, event)
+    res['stats'] = profile.stats(mark)
+    return res
+
+
+def test():
+    import tempfile
+
+    from .driver import integrate
+
+    def oscillator(t, y, out):
+        out[0] = y[1]
+        out[1] = -y[0]
+
+    full = integrate(oscillator, [1., 0.], 0., 10., 0.01, 'rk4')
+    chunks = list((t.copy(), y.copy()) for t, y in integrate_chunks(
+        oscillator, [1., 0.], 0., 10., 0.01, chunk_size=64))
+    assert [len(t) for t, y in chunks] == [64] * 15 + [41]
+    assert numpy.array_equal(numpy.concatenate([y for t, y in chunks]),
+                             full['y'])
+
+    filename = os.path.join(tempfile.mkdtemp(), 'run.npy')
+    res = integrate_to_file(filename, oscillator, [1., 0.], 0., 10., 0.01,
+                            chunk_size=64, checkpoint_every=2)
+    assert numpy.array_equal(res['y'], full['y'])
+    # a finished run is not repeated
+    res = integrate_to_file(filename, oscillator, [1., 0.], 0., 10., 0.01,
+                            chunk_size=64, checkpoint_every=2, resume=True)
+    assert numpy.array_equal(res['t'], full['t'])
+    assert res['nfev'] == full['nfev']
+
+    # run interrupted after the first checkpoint continues exactly
+    with open(filename + '.ckpt', 'rb') as f:
+        state = pickle.load(f)
+    state['done'] = False
+    state['records'] = 128
+    state['y'] = numpy.array(full['y'][127])
+    state['stepper']['nfev'] = 127 * 4
+    _save_checkpoint(filename + '.ckpt', state)
+    res = integrate_to_file(filename, oscillator, [1., 0.], 0., 10., 0.01,
+                            chunk_size=64, checkpoint_every=2, resume=True)
+    assert numpy.array_equal(res['y'], full['y'])
+    assert res['nfev'] == full['nfev']
+    print('stream ok')
+
+
+if __name__ == '__main__':
+    test()
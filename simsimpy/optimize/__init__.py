@@ -1,8 +1,8 @@
 """Optimization module of SimSimPy package.
 
 Contains some optimization functions, or functions for optimizations.
-Depends on numpy and scipy.optimize
-scipy_nlopt_cobyla will not work without nlopt
+Depends on numpy and scipy.optimize, which is imported on first use of a
+scipy wrapper. scipy_nlopt_cobyla will not work without nlopt
 """
 
 __all__ = ["brute", "walk_search", "nlopt_wrap"]
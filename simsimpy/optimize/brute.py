@@ -1,5 +1,7 @@
 import numpy
 
+from .. import profile
+
 
 def brute(func, bounds, Ns, disp=False, *args, **kwargs):
     """Iterative implementation of brute-force optimization.
@@ -17,12 +19,16 @@ def brute(func, bounds, Ns, disp=False, *args, **kwargs):
         x0: A 1-D array containing the coordinates of a point at which the
         objective function had its minimum value.
         fval: Function value at the point x0.
+        stats: stats of func calls, see profile module. None outside of
+            profile.profiling().
     """
+    mark = profile.mark()
+    func = profile.wrap(func, 'func')
     [x, y] = _brute_rec(func, bounds, Ns, disp=disp)
     if disp:
         print()
 
-    return {'x0': x, 'fval': y}
+    return {'x0': x, 'fval': y, 'stats': profile.stats(mark)}
 
 
 def _brute_rec(func, bounds, Ns, x_l=None, disp=False, disp_s=''):
@@ -1,8 +1,4 @@
-from scipy.optimize import OptimizeResult
-try:
-    import nlopt
-except:
-    nlopt = None
+from .. import profile
 
 
 def scipy_nlopt_cobyla(*args, **kwargs):
@@ -17,9 +13,14 @@ def scipy_nlopt_cobyla(*args, **kwargs):
         xtol_rel: same as in nlopt
             one of the tol_rel should be specified
     returns:
-        OptimizeResult() object with properly set x, fun, success.
+        OptimizeResult() object with properly set x, fun, success, stats.
             status is not set when nlopt.RoundoffLimited is raised
     """
+    import nlopt
+    from scipy.optimize import OptimizeResult
+
+    mark = profile.mark()
+    target = profile.wrap(args[0], 'target')
     answ = OptimizeResult()
     bounds = kwargs['bounds']
 
@@ -30,7 +31,7 @@ def scipy_nlopt_cobyla(*args, **kwargs):
         opt.set_ftol_rel(kwargs['ftol_rel'])
     if 'xtol_rel' in list(kwargs.keys()):
         opt.set_ftol_rel(kwargs['xtol_rel'])
-    opt.set_min_objective(args[0])
+    opt.set_min_objective(target)
 
     x0 = list(args[1])
 
@@ -41,6 +42,7 @@ def scipy_nlopt_cobyla(*args, **kwargs):
         answ.fun = args[0](x0)
         answ.success = False
         answ.message = 'nlopt.RoundoffLimited'
+        answ.stats = profile.stats(mark)
         return answ
 
     answ.x = x1
@@ -50,4 +52,5 @@ def scipy_nlopt_cobyla(*args, **kwargs):
     if not answ.fun == opt.last_optimum_value():
         print('Something\'s wrong, ', answ.fun, opt.last_optimum_value())
 
+    answ.stats = profile.stats(mark)
     return answ
@@ -1,6 +1,6 @@
 import numpy
-from ..other import dlogrange
-from scipy.optimize import OptimizeResult
+from .. import profile
+from ..other import Bounds, DLogRange
 
 
 def generate_all_directions(length, root=True):
@@ -60,19 +60,28 @@ def test_nearby_points(target, point, dx, diagonal=False):
     return [directions, res]
 
 
-def _res_around(target, x0, dx, directions, bounds):
-    """Calculates function values around the point from a set of directions."""
-    res = []
-    for direction in directions:
-        x = x0 + direction*dx
-        if bounds is None or bounds(x_new=x):
-            res.append(target(x))
+def _res_around(target, x0, dx, directions, bounds, repair=None):
+    """Calculates function values around the point from a set of directions.
+
+    Returns the points and the values. Points outside of bounds get inf, or
+    are moved inside with repair method of Bounds.
+    """
+    points = x0 + directions*dx
+    if bounds is None:
+        inside = [True]*len(points)
+    elif isinstance(bounds, Bounds):
+        if repair is not None:
+            points = getattr(bounds, repair)(points)
+            inside = [True]*len(points)
         else:
-            res.append(numpy.inf)
-    return res
+            inside = bounds.contains(points)
+    else:
+        inside = [bounds(x_new=x) for x in points]
+    res = [target(x) if ok else numpy.inf for x, ok in zip(points, inside)]
+    return points, res
 
 
-def walk(target, x0, dx, directions, bounds=None, ytol_rel=1e-7):
+def walk(target, x0, dx, directions, bounds=None, ytol_rel=1e-7, repair=None):
     """A simple gradient walk search, that moves point according to dx until
     ytol_rel is met or the minimum is found.
 
@@ -85,29 +94,38 @@ def walk(target, x0, dx, directions, bounds=None, ytol_rel=1e-7):
         dx: scalar step in directions
         directions: list of lists with all possible direction for point
             movement. See generate_directions functions for more info.
-        bounds: a function that evaluates if x is within bounds
+        bounds: a function that evaluates if x is within bounds, or Bounds,
+            which checks all points around at once.
         ytol_rel: search is stopped when 1. - new_min/old_min < ytol_rel. Used
             to cut some long slopes. Set to negative to remove.
+        repair: 'clip', 'reflect' or 'wrap'. Method of Bounds moving points
+            outside of bounds inside instead of skipping them.
     returns:
         x0: point of minimum
         fval: value of target in minimum
         fnval: amount of function evaluations
+        stats: stats of target calls, see profile module. None outside of
+            profile.profiling().
     """
+    mark = profile.mark()
+    target = profile.wrap(target, 'target')
+    directions = numpy.asarray(directions, float)
     fval = target(x0)
-    res = _res_around(target, x0, dx, directions, bounds)
+    points, res = _res_around(target, x0, dx, directions, bounds, repair)
     fnval = len(directions) + 1
     while 1. - min(res) / fval > ytol_rel:
         # update
-        x0 += directions[res.index(min(res))]*dx
+        x0 = points[res.index(min(res))]
         fval = target(x0)
         # calc nearby
-        res = _res_around(target, x0, dx, directions, bounds)
+        points, res = _res_around(target, x0, dx, directions, bounds, repair)
         fnval += len(directions)
-    return {'x0': x0, 'fval': fval, 'fnval': fnval}
+    return {'x0': x0, 'fval': fval, 'fnval': fnval,
+            'stats': profile.stats(mark)}
 
 
 def graduate_walk(target, x0, dx, directions, dx_start, dx_step, bounds=None,
-                  ytol_rel=1e-7):
+                  ytol_rel=1e-7, repair=None):
     """A simple gradient walk search, that moves point according to dx until
     ytol_rel is met or the minimum is found.
 
@@ -126,27 +144,29 @@ def graduate_walk(target, x0, dx, directions, dx_start, dx_step, bounds=None,
             movement. See generate_directions functions for more info.
         dx_start: starting value for dx step. Must be bigger that dx.
         dx_step: change of dx on each iteration. Should be less than 1.
-        bounds: a function that evaluates if x is within bounds
+        bounds: a function that evaluates if x is within bounds, or Bounds.
         ytol_rel: search is stopped when 1. - new_min/old_min < ytol_rel. Used
             to cut some long slopes. Set to negative to remove.
+        repair: see walk.
     returns:
         x0: point of minimum
         fval: value of target in minimum
         fnval: amount of function evaluations
+        stats: see walk.
     """
+    mark = profile.mark()
+    target = profile.wrap(target, 'target')
     fnval = 0
     if dx_start < dx or dx_step >= 1 or dx < 0:
         raise Exception('dx, dx_start or dx_step were set incorrectly.')
-    dxs = list(dlogrange(dx_start, dx_step, stop=dx))
-    if dx not in dxs:
-        dxs.append(dx)
-    for ddx in dxs:
+    for ddx in DLogRange(dx_start, dx_step, stop=dx, endpoint=True):
         res = walk(target, x0, ddx, directions, bounds=bounds,
-                   ytol_rel=ytol_rel)
+                   ytol_rel=ytol_rel, repair=repair)
         x0 = res['x0']
         fnval += res['fnval']
 
-    return {'x0': x0, 'fval': res['fval'], 'fnval': fnval}
+    return {'x0': x0, 'fval': res['fval'], 'fnval': fnval,
+            'stats': profile.stats(mark)}
 
 
 def scipy_walk(*args, **kwargs):
@@ -163,11 +183,14 @@ def scipy_walk(*args, **kwargs):
         bounds=None: list of bounds for the movement
                 [[min, max], [min, max], ...]
             if set to None, bounds are ignored
+        repair=None: 'clip', 'reflect' or 'wrap'. See walk for more info.
         ytol=1e-8: relative tolerance for search stop. See walk for more info.
     returns:
-        OptimizeResult() object with properly set x, fun, nfev.
+        OptimizeResult() object with properly set x, fun, nfev, stats.
             success is always set to True, status to 1
     """
+    from scipy.optimize import OptimizeResult
+
     target = args[0]
     x0 = args[1]
     dx = kwargs['dx'] if 'dx' in list(kwargs.keys()) else 1e-8
@@ -179,9 +202,11 @@ def scipy_walk(*args, **kwargs):
         bounds = Bounds(kwargs['bounds'])
     else:
         bounds = None
+    repair = kwargs['repair'] if 'repair' in list(kwargs.keys()) else None
     ytol_rel = kwargs['ytol_rel'] if 'ytol_rel' in list(kwargs.keys()) else 1e-8
 
-    res = walk(target, x0, dx, directions, bounds=bounds, ytol_rel=ytol_rel)
+    res = walk(target, x0, dx, directions, bounds=bounds, ytol_rel=ytol_rel,
+               repair=repair)
 
     answ = OptimizeResult()
     answ.x = res['x0']
@@ -189,6 +214,7 @@ def scipy_walk(*args, **kwargs):
     answ.success = True
     answ.status = 1
     answ.nfev = res['fnval']
+    answ.stats = res['stats']
     return answ
 
 
@@ -208,12 +234,15 @@ def scipy_graduate_walk(*args, **kwargs):
         bounds=None: list of bounds for the movement
                 [[min, max], [min, max], ...]
             if set to None, bounds are ignored
+        repair=None: 'clip', 'reflect' or 'wrap'. See walk for more info.
         ytol=1e-8: relative tolerance for search stop. See graduate_walk for
             more info.
     returns:
-        OptimizeResult() object with properly set x, fun, nfev.
+        OptimizeResult() object with properly set x, fun, nfev, stats.
             success is always set to True, status to 1
     """
+    from scipy.optimize import OptimizeResult
+
     target = args[0]
     x0 = args[1]
     dx = kwargs['dx'] if 'dx' in list(kwargs.keys()) else 1e-8
@@ -227,10 +256,11 @@ def scipy_graduate_walk(*args, **kwargs):
         bounds = Bounds(kwargs['bounds'])
     else:
         bounds = None
+    repair = kwargs['repair'] if 'repair' in list(kwargs.keys()) else None
     ytol_rel = kwargs['ytol_rel'] if 'ytol_rel' in list(kwargs.keys()) else 1e-8
 
     res = graduate_walk(target, x0, dx, directions, dx_start, dx_step,
-                        bounds=bounds, ytol_rel=ytol_rel)
+                        bounds=bounds, ytol_rel=ytol_rel, repair=repair)
 
     answ = OptimizeResult()
     answ.x = res['x0']
@@ -238,4 +268,5 @@ def scipy_graduate_walk(*args, **kwargs):
     answ.success = True
     answ.status = 1
     answ.nfev = res['fnval']
+    answ.stats = res['stats']
     return answ
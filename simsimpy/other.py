@@ -1,7 +1,12 @@
 import os
 import sys
+import gzip
 import math
 import time
+import queue
+import atexit
+import shutil
+import threading
 
 import numpy
 
@@ -54,6 +59,143 @@ def dlogrange(start, step, steps=-1, stop=None):
         r = round(r, rnd)
 
 
+class DxRange(object):
+    """Floating-point range with length, indexing, slicing and membership.
+
+    Same numbers as dxrange from start to stop inclusive, but i-th number
+    is computed as start + i*step, so errors do not accumulate, and stop is
+    returned exactly if it is on the grid. Slices are returned as arrays.
+
+    parameters:
+        start, stop, step: as in dxrange, step must be positive.
+        rnd: amount of decimals to round numbers to, no rounding if None.
+    """
+    def __init__(self, start, stop, step=1., rnd=None):
+        if step <= 0:
+            raise ValueError("Step of DxRange must be positive.")
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.rnd = rnd
+        self._len = max(0, int(math.ceil((stop - start)/step + 0.001)))
+        self._last = self._len - 1
+        if abs(start + self._last*step - stop) >= 0.001*step:
+            self._last = None
+
+    def _values(self, i):
+        """Numbers of integer array of indices i."""
+        x = self.start + i*self.step
+        if self.rnd is not None:
+            x = numpy.round(x, self.rnd)
+        if self._last is not None:
+            x = numpy.where(i == self._last, self.stop, x)
+        return x
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._values(numpy.arange(*i.indices(self._len)))
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("DxRange index out of range.")
+        if i == self._last:
+            return self.stop
+        x = self.start + i*self.step
+        if self.rnd is not None:
+            x = float(numpy.round(x, self.rnd))
+        return x
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self[i]
+
+    def __contains__(self, x):
+        k = (x - self.start) / self.step
+        i = int(round(k))
+        return 0 <= i < self._len and abs(k - i) < 1e-9
+
+    def __repr__(self):
+        return 'DxRange(%r, %r, %r)' % (self.start, self.stop, self.step)
+
+    def as_array(self):
+        """All numbers of the range as an array."""
+        return self._values(numpy.arange(self._len))
+
+
+class DLogRange(object):
+    """Floating-point exponential range with length, indexing and slicing.
+
+    Same numbers as dlogrange, but i-th number is computed as
+    start*step**i, so errors do not accumulate. Slices are returned as
+    arrays.
+
+    parameters:
+        start, step, steps, stop: as in dlogrange. stop is not included if
+            it is on the grid.
+        endpoint: if True, stop is always the last number, and numbers
+            before it are the ones not passing it.
+    """
+    def __init__(self, start, step, steps=-1, stop=None, endpoint=False):
+        if step == 1:
+            raise ValueError("Power of 1 increment, choose different step.")
+        self.start = start
+        self.step = step
+        self.stop = stop
+        self.endpoint = endpoint and stop is not None
+        if steps < 0 and stop is not None:
+            k = math.log(stop/start) / math.log(step)
+            steps = max(0, int(math.ceil(k - 1e-9)))
+            if self.endpoint:
+                steps += 1
+        self._len = int(steps)
+        self._log_step = math.log(abs(step))
+
+    def _values(self, i):
+        """Numbers of integer array of indices i."""
+        x = self.start * self.step**i.astype(float)
+        if self.endpoint:
+            x = numpy.where(i == self._len - 1, self.stop, x)
+        return x
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._values(numpy.arange(*i.indices(self._len)))
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("DLogRange index out of range.")
+        if self.endpoint and i == self._len - 1:
+            return self.stop
+        return self.start * self.step**float(i)
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self[i]
+
+    def __contains__(self, x):
+        if self.endpoint and x == self.stop:
+            return True
+        if x == 0 or (x > 0) != (self.start > 0) or self.step < 0:
+            return any(x == y for y in self)
+        k = math.log(x/self.start) / self._log_step
+        i = int(round(k))
+        n = self._len - 1 if self.endpoint else self._len
+        return 0 <= i < n and abs(k - i) < 1e-9
+
+    def __repr__(self):
+        return 'DLogRange(%r, %r, %r)' % (self.start, self.step, self._len)
+
+    def as_array(self):
+        """All numbers of the range as an array."""
+        return self._values(numpy.arange(self._len))
+
+
 class Bounds(object):
     """Creates callable Bounds object from a list of bounds.
 
@@ -61,21 +203,67 @@ class Bounds(object):
     instance of Bounds(x, ...) or Bounds(x_new=x) or Bounds(x=x) checks if x
         is inside bounds.
     priority: kwargs x, kwargs x_new, args.
+
+    Batch methods take array of points of shape (..., d), e.g. (m, d) for m
+    points of dimension d.
     """
     def __init__(self, bounds):
         self.min = numpy.array([bound[0] for bound in bounds])
         self.max = numpy.array([bound[1] for bound in bounds])
+        self.width = self.max - self.min
+        self._finite = numpy.isfinite(self.width)
 
     def __call__(self, *args, **kwargs):
-        if 'x' in list(kwargs.keys()):
+        if not kwargs:
+            x = args[0]
+        elif 'x' in kwargs:
             x = kwargs['x']
-        elif 'x_new' in list(kwargs.keys()):
+        elif 'x_new' in kwargs:
             x = kwargs['x_new']
         else:
             x = args[0]
         return (bool(numpy.all(x <= self.max)) and
                 bool(numpy.all(x >= self.min)))
 
+    def contains(self, points):
+        """Boolean mask of points inside bounds, shape (...)."""
+        return numpy.all((points >= self.min) & (points <= self.max),
+                         axis=-1)
+
+    def clip(self, points):
+        """Moves points outside to the nearest border."""
+        return numpy.minimum(numpy.maximum(points, self.min), self.max)
+
+    def reflect(self, points):
+        """Reflects points outside from the borders back inside.
+
+        Points are reflected as many times as needed, dimensions with one
+        infinite border are reflected from the other one.
+        """
+        points = numpy.asarray(points, float)
+        width = numpy.where(self._finite & (self.width > 0), self.width, 1.)
+        # dimensions with infinite width are computed from 0 and dropped
+        low = numpy.where(self._finite, self.min, 0.)
+        y = numpy.mod(points - low, 2*width)
+        y = low + numpy.where(y > width, 2*width - y, y)
+        y = numpy.where(self.width == 0, self.min, y)
+        # dimensions with infinite width
+        half = numpy.where(points < self.min, 2*self.min - points, points)
+        half = numpy.where(half > self.max, 2*self.max - half, half)
+        return numpy.where(self._finite, y, half)
+
+    def wrap(self, points):
+        """Wraps points periodically into bounds.
+
+        Dimensions with infinite width are clipped instead.
+        """
+        points = numpy.asarray(points, float)
+        width = numpy.where(self._finite & (self.width > 0), self.width, 1.)
+        low = numpy.where(self._finite, self.min, 0.)
+        y = low + numpy.mod(points - low, width)
+        y = numpy.where(self.width == 0, self.min, y)
+        return numpy.where(self._finite, y, self.clip(points))
+
 
 class Logger(object):
     """Doubles output into a file
@@ -83,19 +271,235 @@ class Logger(object):
     Usage:
         sys.stdout = Logger()
     Filename defaults to <pid>.log
+
+    Writes to the file are queued and done by a background thread in
+    batches, which are flushed when they reach flush_size characters, after
+    flush_interval seconds, on flush() and at exit. Errors of the file writes
+    are raised by the next write() or flush(), output after close() goes to
+    the terminal only. Terminal echo is line
+    buffered, and lines ending with '\r' (progress lines) are shown at most
+    once per echo_interval seconds, the skipped ones go only to the file.
+
+    parameters:
+        filename: log file, opened for appending.
+        echo: doubles output into the terminal if True.
+        flush_size: amount of characters written to the file at once.
+        flush_interval: maximal delay of writes in seconds.
+        echo_interval: minimal time between progress lines in seconds.
+        max_bytes: file is rotated when it grows above max_bytes, never if
+            None. Rotated files are filename.1, filename.2, ...
+        backup_count: amount of rotated files kept.
+        compress: gzip rotated files into filename.1.gz, ...
     """
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, echo=True, flush_size=65536,
+                 flush_interval=1., echo_interval=0.1, max_bytes=None,
+                 backup_count=3, compress=False):
         self.terminal = sys.stdout
         if filename is None:
             filename = str(os.getpid()) + '.log'
+        self.filename = filename
         self.log = open(filename, 'a')
+        self.echo = echo
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.echo_interval = echo_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self._line = ''
+        self._echo_time = 0.
+        self._queue = queue.Queue()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
 
     def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
+        if self._closed:
+            self.terminal.write(message)
+            return
+        self._raise_error()
+        self._queue.put(message)
+        if self.echo:
+            self._echo(message)
+
+    def _echo(self, message):
+        """Writes complete lines into the terminal, limits progress lines."""
+        self._line += message
+        if '\n' in message:
+            self.terminal.write(self._line)
+            self._line = ''
+        elif '\r' in message:
+            now = time.monotonic()
+            if now - self._echo_time >= self.echo_interval:
+                self.terminal.write(self._line)
+                self.terminal.flush()
+                self._echo_time = now
+            self._line = self._line[self._line.rindex('\r') + 1:]
 
     def flush(self):
-        #this flush method is needed for python 3 compatibility.
-        #this handles the flush command by doing nothing.
-        #you might want to specify some extra behavior here.
+        """Writes everything written so far to the file and terminal."""
+        if self.echo and self._line:
+            self.terminal.write(self._line)
+            self._line = ''
+        self.terminal.flush()
+        if not self._closed:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+            self._raise_error()
+
+    def _raise_error(self):
+        """Raises the last error of the background thread once."""
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Flushes and stops the background thread, called at exit."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+            atexit.unregister(self.close)
+            self.log.close()
+
+    def _run(self):
+        """Background thread collecting messages into batches."""
+        batch = []
+        size = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(0., deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+            if isinstance(item, str):
+                batch.append(item)
+                size += len(item)
+                if size < self.flush_size:
+                    continue
+            if batch:
+                try:
+                    self.log.write(''.join(batch))
+                    self.log.flush()
+                    if (self.max_bytes is not None and
+                            self.log.tell() >= self.max_bytes):
+                        self._rotate()
+                except Exception as e:
+                    # kept for write() or flush(), the batch is lost
+                    self._error = e
+                batch = []
+                size = 0
+            deadline = time.monotonic() + self.flush_interval
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _rotate(self):
+        """Moves filename to filename.1, filename.1 to filename.2, ..."""
+        self.log.close()
+        ext = '.gz' if self.compress else ''
+        names = ['%s.%d%s' % (self.filename, i, ext)
+                 for i in range(1, self.backup_count + 1)]
+        if names:
+            if os.path.exists(names[-1]):
+                os.remove(names[-1])
+            for old, new in reversed(list(zip(names[:-1], names[1:]))):
+                if os.path.exists(old):
+                    os.replace(old, new)
+            if self.compress:
+                with open(self.filename, 'rb') as f_in:
+                    with gzip.open(names[0], 'wb') as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+                os.remove(self.filename)
+            else:
+                os.replace(self.filename, names[0])
+        self.log = open(self.filename, 'w')
+
+
+def test():
+    # ranges give the numbers of the generators
+    r = DxRange(0., 1., 0.1)
+    assert numpy.allclose(list(r), list(dxrange(0., 1., 0.1)))
+    assert len(r) == 11 and r[-1] == 1. and r[10] == 1.
+    assert 0.3 in r and 0.35 not in r and 1.1 not in r
+    assert numpy.allclose(r[2:5], [0.2, 0.3, 0.4])
+    assert numpy.allclose(r.as_array(), numpy.linspace(0., 1., 11))
+    r = DLogRange(1., 2., stop=100.)
+    assert list(r) == list(dlogrange(1., 2., stop=100.))
+    assert len(r) == 7 and r[-1] == 64. and 64. in r and 128. not in r
+    r = DLogRange(0.1, 0.5, stop=1e-3, endpoint=True)
+    assert len(r) == 8 and r[-1] == 1e-3 and r[-2] == 0.1 / 64
+
+    # batch projections into bounds
+    b = Bounds([[0., 1.], [-numpy.inf, 2.], [1., numpy.inf], [3., 3.]])
+    p = numpy.array([[2.5, 3., -1., 7.], [-0.2, -5., 4., 3.]])
+    assert list(b.contains(p)) == [False, False]
+    assert b.contains(numpy.array([0.5, -5., 4., 3.]))
+    assert numpy.array_equal(b.clip(p), [[1., 2., 1., 3.],
+                                         [0., -5., 4., 3.]])
+    assert numpy.allclose(b.reflect(p), [[0.5, 1., 3., 3.],
+                                         [0.2, -5., 4., 3.]])
+    assert numpy.allclose(b.wrap(p), [[0.5, 2., 1., 3.],
+                                      [0.8, -5., 4., 3.]])
+    assert b.contains(b.reflect(p)).all() and b.contains(b.wrap(p)).all()
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        b.reflect(p)
+        b.wrap(p)
+
+    # rotated files keep the end of the log
+    import tempfile
+    directory = tempfile.mkdtemp()
+    lines = ['line %d\n' % i for i in range(100)]
+    for compress in (False, True):
+        filename = os.path.join(directory, 'test%d.log' % compress)
+        log = Logger(filename, echo=False, flush_size=10, max_bytes=100,
+                     backup_count=2, compress=compress)
+        for line in lines:
+            log.write(line)
+        log.flush()
+        text = ''
+        for name in [filename + '.2', filename + '.1']:
+            if compress:
+                with gzip.open(name + '.gz', 'rt') as f:
+                    text += f.read()
+            else:
+                with open(name) as f:
+                    text += f.read()
+        with open(filename) as f:
+            text += f.read()
+        assert ''.join(lines).endswith(text) and len(text) > 200
+        assert not os.path.exists(filename + '.3')
+        log.close()
+        log.close()
+
+    # errors of the background writes are raised, not waited for
+    import io
+    log = Logger(os.path.join(directory, 'error.log'), echo=False)
+    log.terminal = io.StringIO()
+    log.log.close()
+    log.write('lost\n')
+    try:
+        log.flush()
+        raise AssertionError('write into a closed file did not fail')
+    except ValueError:
         pass
+    log.close()
+    assert not log._thread.is_alive()
+    # output after close goes to the terminal
+    log.write('late\n')
+    assert log.terminal.getvalue() == 'late\n'
+
+
+if __name__ == '__main__':
+    test()
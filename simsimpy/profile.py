@@ -0,0 +1,184 @@
+"""Profiling of user callbacks: objective functions and right sides.
+
+Usage:
+    with profile.profiling() as prof:
+        res = intstep.integrate(right_side, y0, 0., 100., 0.01)
+    print(res['stats']['calls']['right_side']['p99'])
+    print(prof.stats())
+
+While a profiler is active, integrators and optimizers wrap the callbacks
+to time every call, and add stats of their own run to the result. Outside
+of profiling() callbacks are not wrapped and stats of results are None.
+"""
+import time
+import functools
+import contextlib
+
+import numpy
+
+
+_active = None
+
+
+class _Calls(object):
+    """Latencies of calls of one callback in a growing array."""
+    def __init__(self):
+        self.n = 0
+        self.latencies = numpy.empty(1024)
+
+    def add(self, latency):
+        if self.n == len(self.latencies):
+            self.latencies = numpy.resize(self.latencies, 2*self.n)
+        self.latencies[self.n] = latency
+        self.n += 1
+
+    def summary(self, first=0):
+        """Call count, total and percentiles of latency in seconds."""
+        lat = self.latencies[first:self.n]
+        if not len(lat):
+            return {'calls': 0, 'total': 0., 'mean': 0., 'p50': 0.,
+                    'p90': 0., 'p99': 0., 'max': 0.}
+        p50, p90, p99 = numpy.percentile(lat, [50, 90, 99])
+        return {'calls': len(lat), 'total': float(lat.sum()),
+                'mean': float(lat.mean()), 'p50': float(p50),
+                'p90': float(p90), 'p99': float(p99),
+                'max': float(lat.max())}
+
+
+class Profiler(object):
+    """Collects latencies of wrapped callbacks by name.
+
+    Attributes:
+    calls: dictionary of callback names and their latencies.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.start = time.perf_counter()
+
+    def wrap(self, func, name):
+        """Wraps func to record latency of every call under name.
+
+        Functions already wrapped by this profiler are returned as they are.
+        """
+        if func is None or getattr(func, '_profiler', None) is self:
+            return func
+        record = self.calls.setdefault(name, _Calls())
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record.add(perf_counter() - t)
+        wrapper._profiler = self
+        return wrapper
+
+    def mark(self):
+        """Current time and call counts, to take stats since them."""
+        return (self, time.perf_counter(),
+                dict((name, c.n) for name, c in self.calls.items()))
+
+    def stats(self, mark=None):
+        """Stats of calls since mark, or since the profiler was created.
+
+        returns:
+            calls: dictionary of callback names and summaries of their
+                calls, see _Calls.summary.
+            wall: time passed in seconds.
+            callbacks: time spent inside the callbacks.
+            library: the rest of the time.
+        """
+        start, counts = (self.start, {}) if mark is None else mark[1:]
+        wall = time.perf_counter() - start
+        calls = dict((name, c.summary(counts.get(name, 0)))
+                     for name, c in self.calls.items())
+        callbacks = sum(c['total'] for c in calls.values())
+        return {'calls': calls, 'wall': wall, 'callbacks': callbacks,
+                'library': wall - callbacks}
+
+
+@contextlib.contextmanager
+def profiling(profiler=None):
+    """Activates profiler, a new Profiler by default, and yields it."""
+    global _active
+    if profiler is None:
+        profiler = Profiler()
+    previous = _active
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+
+def active():
+    """Active Profiler, None outside of profiling()."""
+    return _active
+
+
+def wrap(func, name):
+    """func wrapped by the active profiler, func itself if there is none."""
+    if _active is None:
+        return func
+    return _active.wrap(func, name)
+
+
+def mark():
+    """Mark of the active profiler for stats, None if there is none."""
+    if _active is None:
+        return None
+    return _active.mark()
+
+
+def stats(mark):
+    """Stats since mark, None if it was taken without active profiler."""
+    if mark is None:
+        return None
+    return mark[0].stats(mark)
+
+
+def test():
+    def slow(x):
+        time.sleep(0.002)
+        return x
+
+    assert wrap(slow, 'slow') is slow and mark() is None
+    with profiling() as profiler:
+        f = wrap(slow, 'slow')
+        assert wrap(f, 'slow') is f and active() is profiler
+        f(0)
+        start = mark()
+        for i in range(10):
+            assert f(i) == i
+        res = stats(start)
+    calls = res['calls']['slow']
+    assert calls['calls'] == 10 and calls['p50'] >= 0.002
+    assert res['wall'] >= res['callbacks'] >= 0.02 and res['library'] >= 0
+    assert profiler.stats()['calls']['slow']['calls'] == 11
+
+    # integrators add stats of their own run
+    from .intstep import integrate
+
+    def right_side(t, y, out):
+        out.fill(1.)
+
+    with profiling():
+        res = integrate(right_side, [0.], 0., 1., 0.1)
+    assert res['stats']['calls']['right_side']['calls'] == 40
+    assert integrate(right_side, [0.], 0., 1., 0.1)['stats'] is None
+    from .intstep import integrate_ensemble, Event
+
+    with profiling():
+        res = integrate(right_side, [0.], 0., 1., 0.1,
+                        event=Event(lambda t, y: y - 0.5, lambda t, y, i: 0))
+        assert res['stats']['calls']['event_func']['calls'] >= 11
+        assert res['stats']['calls']['event_reset']['calls'] == 1
+        res = integrate_ensemble(right_side, numpy.zeros((2, 1)), 0., 1.,
+                                 0.1, done=lambda t, y: y[:, 0] > 0.5)
+        assert res['stats']['calls']['done']['calls'] == 7
+
+
+if __name__ == '__main__':
+    test()
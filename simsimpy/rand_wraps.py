@@ -1,22 +1,48 @@
-def range_generate_regenerate(gen, mi, ma, cntr=None):
+"""Wrappers around random number generators.
+
+Scalar functions take gen(), which returns one random number. Array versions
+take gen(n), which returns an array of n random numbers, e.g.
+lambda n: rng.normal(0., 1., n) for a numpy.random.Generator rng.
+
+Truncated samplers draw inside [mi, ma] by inversion of the distribution
+function, so the cost per sample does not depend on the probability of the
+interval. They require scipy, which is imported on first use.
+"""
+import hashlib
+
+import numpy
+
+
+def _count(stats, drawn, accepted, clipped):
+    """Adds amounts of numbers to the stats dictionary."""
+    for name, n in (('drawn', drawn), ('accepted', accepted),
+                    ('clipped', clipped)):
+        stats[name] = stats.get(name, 0) + n
+
+
+def range_generate_regenerate(gen, mi, ma, cntr=None, stats=None):
     """Uses gen to generate a random number inside [mi, ma].
 
     Random number is regenerated until it is inside [mi, ma] bounds. Counter
     could be specified to limit number of iterations. If the limit is reached,
-    warning is raised and the border solution is returned.
+    warning is raised and the border solution is returned. If stats
+    dictionary is given, amounts of drawn, accepted and clipped numbers are
+    added to its items 'drawn', 'accepted' and 'clipped'.
     """
     if mi == ma:
         return mi
     ans = gen()
-    if cntr is not None:
-        i = 0
+    i = 0
+    clipped = 0
     while ans > ma or ans < mi:
         ans = gen()
-        if cntr is not None:
-            i += 1
-            if i > cntr:
-                ans = ma if ans > ma else mi
-                break
+        i += 1
+        if cntr is not None and i > cntr:
+            ans = ma if ans > ma else mi
+            clipped = 1
+            break
+    if stats is not None:
+        _count(stats, i + 1, 1 - clipped, clipped)
     return ans
 
 
@@ -33,6 +59,190 @@ def range_generate_doborder(gen, mi, ma):
     return ans
 
 
+def _bounds(mi, ma, size):
+    """Broadcasts bounds to size, returns flat bounds and the shape."""
+    if size is None:
+        size = numpy.broadcast(mi, ma).shape
+    elif numpy.isscalar(size):
+        size = (size,)
+    mi = numpy.broadcast_to(mi, size).ravel()
+    ma = numpy.broadcast_to(ma, size).ravel()
+    return mi, ma, tuple(size)
+
+
+def range_generate_regenerate_array(gen, mi, ma, size=None, cntr=None,
+                                    stats=None):
+    """Array version of range_generate_regenerate.
+
+    All numbers are drawn at once, then only the ones outside of their
+    bounds are redrawn, until none is left. Elements still outside after
+    cntr redraws are set to the border they crossed.
+
+    parameters:
+        gen: gen(n) returns array of n random numbers.
+        mi, ma: bounds, scalars or arrays broadcastable to size.
+        size: shape of the result, shape of broadcast bounds by default.
+        cntr: maximal amount of redraws, unlimited if None.
+        stats: dictionary to count numbers in, see
+            range_generate_regenerate.
+    returns:
+        array of shape size.
+    """
+    mi, ma, size = _bounds(mi, ma, size)
+    ans = numpy.asarray(gen(mi.size), float).reshape(-1).copy()
+    equal = mi == ma
+    ans[equal] = mi[equal]
+    idx = numpy.flatnonzero((ans > ma) | (ans < mi))
+    i = 0
+    drawn = ans.size
+    clipped = 0
+    while idx.size:
+        if cntr is not None and i > cntr:
+            ans[idx] = numpy.where(ans[idx] > ma[idx], ma[idx], mi[idx])
+            clipped = idx.size
+            break
+        ans[idx] = gen(idx.size)
+        drawn += idx.size
+        idx = idx[(ans[idx] > ma[idx]) | (ans[idx] < mi[idx])]
+        i += 1
+    if stats is not None:
+        _count(stats, drawn, ans.size - clipped, clipped)
+    return ans.reshape(size)
+
+
+def range_generate_doborder_array(gen, mi, ma, size=None):
+    """Array version of range_generate_doborder.
+
+    parameters:
+        gen: gen(n) returns array of n random numbers.
+        mi, ma: bounds, scalars or arrays broadcastable to size.
+        size: shape of the result, shape of broadcast bounds by default.
+    returns:
+        array of shape size.
+    """
+    mi, ma, size = _bounds(mi, ma, size)
+    ans = numpy.asarray(gen(mi.size), float).reshape(-1)
+    return numpy.minimum(numpy.maximum(ans, mi), ma).reshape(size)
+
+
+class BufferedRandom(object):
+    """Random numbers drawn in blocks and served one by one.
+
+    Drop-in gen for both scalar and array functions of this module. For gen
+    drawing from a numpy.random.Generator the sequence of numbers does not
+    depend on block_size.
+
+    parameters:
+        gen: gen(n) returns array of n random numbers, e.g.
+            lambda n: rng.normal(0., 1., n).
+        block_size: amount of numbers drawn at once.
+
+    Example:
+        gen = BufferedRandom(lambda n: rng.normal(0., 1., n))
+        w = range_generate_regenerate(gen, 0., 1.)
+    """
+    def __init__(self, gen, block_size=4096):
+        self.gen = gen
+        self.block_size = block_size
+        self._block = []
+        self._i = 0
+
+    def __call__(self, n=None):
+        """Next number, or array of next n numbers."""
+        if n is not None:
+            return self._many(n)
+        if self._i == len(self._block):
+            self._block = self.gen(self.block_size).tolist()
+            self._i = 0
+        self._i += 1
+        return self._block[self._i - 1]
+
+    def _many(self, n):
+        rest = self._block[self._i:self._i + n]
+        self._i += len(rest)
+        if len(rest) == n:
+            return numpy.array(rest)
+        return numpy.concatenate((rest, self.gen(n - len(rest))))
+
+
+class RandomStreams(object):
+    """Independent random generators identified by keys, from one seed.
+
+    Generator of a key is derived from the root seed and the key only, so it
+    is the same whichever process asks for it and in whatever order. Keys
+    are integers in [0, 2**64) or strings, e.g. generator('trial', 3) or
+    generator('population', 'exc'). RandomStreams are picklable and may be
+    sent to worker processes, spawn gives one with a key prefix.
+
+    parameters:
+        seed: root seed, fresh entropy if None.
+        spawn_key: key prefix of all streams.
+
+    Attributes:
+    entropy: root seed, pass it to reproduce a run seeded with None.
+    """
+    def __init__(self, seed=None, spawn_key=()):
+        self.entropy = numpy.random.SeedSequence(seed).entropy
+        self.spawn_key = tuple(spawn_key)
+        self._generators = {}
+
+    @staticmethod
+    def _key(key):
+        """Spawn key words of a key.
+
+        Every part starts with a type tag word, integers take two more
+        words and strings four words of their hash, so parts of different
+        keys never coincide.
+        """
+        words = []
+        for k in key:
+            if isinstance(k, str):
+                digest = hashlib.blake2b(k.encode(), digest_size=16).digest()
+                words.append(1)
+                words.extend(int.from_bytes(digest[i:i + 4], 'little')
+                             for i in range(0, 16, 4))
+            else:
+                k = int(k)
+                if not 0 <= k < 2**64:
+                    raise ValueError('Integer keys must be in [0, 2**64).')
+                words.extend((0, k & 0xffffffff, k >> 32))
+        return tuple(words)
+
+    def seed_sequence(self, *key):
+        """numpy.random.SeedSequence of the stream."""
+        return numpy.random.SeedSequence(
+            self.entropy, spawn_key=self.spawn_key + self._key(key))
+
+    def generator(self, *key):
+        """numpy.random.Generator of the stream, same object for same key."""
+        return self._generator(self._key(key))
+
+    def _generator(self, words):
+        """Generator of the stream with spawn key words."""
+        if words not in self._generators:
+            self._generators[words] = numpy.random.Generator(
+                numpy.random.PCG64(numpy.random.SeedSequence(
+                    self.entropy, spawn_key=self.spawn_key + words)))
+        return self._generators[words]
+
+    def spawn(self, *key):
+        """RandomStreams with streams under the key."""
+        return RandomStreams(self.entropy, self.spawn_key + self._key(key))
+
+    def get_state(self):
+        """Root seed, prefix and states of all handed out generators."""
+        return {'entropy': self.entropy, 'spawn_key': self.spawn_key,
+                'generators': dict((k, g.bit_generator.state)
+                                   for k, g in self._generators.items())}
+
+    def set_state(self, state):
+        self.entropy = state['entropy']
+        self.spawn_key = tuple(state['spawn_key'])
+        self._generators = {}
+        for key, rng_state in state['generators'].items():
+            self._generator(tuple(key)).bit_generator.state = rng_state
+
+
 def gamma_meanvariance_to_alphabeta(mean, variance):
     """Alpha-beta python style. E.g. k-theta wikipedia style."""
     return [variance/mean, mean*mean/variance]
@@ -41,3 +251,308 @@ def gamma_meanvariance_to_alphabeta(mean, variance):
 def gamma_meansigma_to_alphabeta(mean, sigma):
     """Alpha-beta python style. E.g. k-theta wikipedia style."""
     return gamma_meanvariance_to_alphabeta(mean, sigma*sigma)
+
+
+def lognormal_meanvariance_to_musigma(mean, variance):
+    """Mean and sigma of the underlying normal distribution, numpy style."""
+    s2 = numpy.log1p(variance / (mean*mean))
+    return [numpy.log(mean) - s2/2, numpy.sqrt(s2)]
+
+
+def lognormal_meansigma_to_musigma(mean, sigma):
+    """Mean and sigma of the underlying normal distribution, numpy style."""
+    return lognormal_meanvariance_to_musigma(mean, sigma*sigma)
+
+
+def _uniform(rng, size, *params):
+    """Uniform [0, 1) numbers of size or of shape of broadcast params."""
+    if size is None:
+        size = numpy.broadcast(*params).shape
+    return numpy.random.default_rng(rng).random(size)
+
+
+def _standard_normal(a, b, u):
+    """Inverts normal distribution function of standard normal in [a, b].
+
+    Intervals in the upper tail are mirrored into the lower one, where the
+    distribution function is computed in logarithms, so it does not lose
+    precision however far the interval is.
+    """
+    from scipy.special import log_ndtr, ndtri_exp
+
+    flip = a > 0
+    a, b = numpy.where(flip, -b, a), numpy.where(flip, -a, b)
+    la, lb = log_ndtr(a), log_ndtr(b)
+    with numpy.errstate(divide='ignore'):
+        lp = numpy.logaddexp(la + numpy.log1p(-u), lb + numpy.log(u))
+    x = numpy.minimum(numpy.maximum(ndtri_exp(lp), a), b)
+    return numpy.where(flip, -x, x)
+
+
+def truncated_normal(mean, sigma, mi, ma, size=None, rng=None):
+    """Normal random numbers inside [mi, ma].
+
+    parameters:
+        mean, sigma: parameters of the normal distribution.
+        mi, ma: bounds, may be infinite.
+        all of them are scalars or arrays broadcastable to size.
+        size: shape of the result, shape of broadcast parameters by default.
+        rng: numpy.random.Generator or a seed.
+    """
+    u = _uniform(rng, size, mean, sigma, mi, ma)
+    mean = numpy.asarray(mean, float)
+    a = (mi - mean) / sigma
+    b = (ma - mean) / sigma
+    return mean + sigma * _standard_normal(a, b, u)
+
+
+def truncated_lognormal(mean, sigma, mi, ma, size=None, rng=None):
+    """Lognormal random numbers inside [mi, ma].
+
+    mean and sigma are of the lognormal distribution itself, other
+    parameters are the same as in truncated_normal.
+    """
+    u = _uniform(rng, size, mean, sigma, mi, ma)
+    mu, s = lognormal_meansigma_to_musigma(mean, sigma)
+    with numpy.errstate(divide='ignore'):
+        a = (numpy.log(numpy.maximum(mi, 0.)) - mu) / s
+        b = (numpy.log(numpy.maximum(ma, 0.)) - mu) / s
+    return numpy.exp(mu + s * _standard_normal(a, b, u))
+
+
+def truncated_gamma(mean, sigma, mi, ma, size=None, rng=None):
+    """Gamma random numbers inside [mi, ma].
+
+    Intervals above the median are inverted through the upper tail.
+    Parameters are the same as in truncated_normal.
+    """
+    from scipy.special import gammainc, gammaincc, gammaincinv, gammainccinv
+
+    u = _uniform(rng, size, mean, sigma, mi, ma)
+    scale, shape = gamma_meansigma_to_alphabeta(mean, sigma)
+    a = numpy.maximum(mi, 0.) / scale
+    b = numpy.maximum(ma, 0.) / scale
+    upper = gammainc(shape, a) > 0.5
+    with numpy.errstate(invalid='ignore'):
+        p = gammainc(shape, a) * (1. - u) + gammainc(shape, b) * u
+        q = gammaincc(shape, a) * (1. - u) + gammaincc(shape, b) * u
+        x = numpy.where(upper, gammainccinv(shape, q), gammaincinv(shape, p))
+    return scale * numpy.minimum(numpy.maximum(x, a), b)
+
+
+def truncated_exponential(mean, mi, ma, size=None, rng=None):
+    """Exponential random numbers inside [mi, ma].
+
+    Parameters are the same as in truncated_normal.
+    """
+    u = _uniform(rng, size, mean, mi, ma)
+    mi = numpy.maximum(mi, 0.)
+    x = mi - mean * numpy.log1p(u * numpy.expm1(-(ma - mi) / mean))
+    return numpy.minimum(x, ma)
+
+
+def _draw_normal(rng, mean, sigma, n):
+    return rng.normal(mean, sigma, n)
+
+
+def _draw_lognormal(rng, mean, sigma, n):
+    mu, s = lognormal_meansigma_to_musigma(mean, sigma)
+    return rng.lognormal(mu, s, n)
+
+
+def _draw_gamma(rng, mean, sigma, n):
+    scale, shape = gamma_meansigma_to_alphabeta(mean, sigma)
+    return rng.gamma(shape, scale, n)
+
+
+def _draw_exponential(rng, mean, n):
+    return rng.exponential(mean, n)
+
+
+class AdaptiveSampler(object):
+    """Bounded sampler switching from rejection to truncated sampling.
+
+    Numbers are drawn from the full distribution and rejected outside of
+    [mi, ma], while acceptance rate of the parameter set stays above
+    threshold. Below it the rest of the numbers and all later calls with the
+    same parameter set use the truncated sampler. Both give exact samples.
+
+    parameters:
+        rng: numpy.random.Generator or a seed.
+        threshold: minimal acceptance rate of rejection sampling.
+        min_draws: amount of draws before acceptance rate is trusted.
+
+    Attributes:
+    stats: dictionary of parameter sets, keyed by (distribution, parameters,
+        mi, ma) of scalar calls or by the key given to the call, values are
+        dictionaries with amounts of 'drawn' and 'accepted' numbers in
+        rejection sampling and the 'method' in use. Calls with array
+        parameters and no key are not remembered, they decide per call.
+    """
+    distributions = {
+        'normal': (_draw_normal, truncated_normal),
+        'lognormal': (_draw_lognormal, truncated_lognormal),
+        'gamma': (_draw_gamma, truncated_gamma),
+        'exponential': (_draw_exponential, truncated_exponential)}
+
+    def __init__(self, rng=None, threshold=0.1, min_draws=1000):
+        self.rng = numpy.random.default_rng(rng)
+        self.threshold = threshold
+        self.min_draws = min_draws
+        self.stats = {}
+
+    @staticmethod
+    def _key(dist, params, mi, ma):
+        """Key of scalar parameters, None if any of them is an array."""
+        key = [dist]
+        for p in tuple(params) + (mi, ma):
+            if numpy.ndim(p):
+                return None
+            key.append(float(p))
+        return tuple(key)
+
+    def __call__(self, dist, params, mi, ma, size=None, key=None):
+        """Random numbers inside [mi, ma].
+
+        parameters:
+            dist: 'normal', 'lognormal' or 'gamma' with params (mean,
+                sigma), or 'exponential' with params (mean,).
+            params, mi, ma: scalars or arrays broadcastable to size.
+            size: shape of the result, shape of broadcast parameters by
+                default.
+            key: hashable key of the parameter set in stats, e.g. name of
+                a synapse population with array parameters.
+        """
+        draw, truncated = self.distributions[dist]
+        if key is None:
+            key = self._key(dist, params, mi, ma)
+        stats = {'drawn': 0, 'accepted': 0, 'method': 'rejection'}
+        if key is not None:
+            stats = self.stats.setdefault(key, stats)
+        if stats['method'] == 'truncated':
+            return truncated(*(tuple(params) + (mi, ma, size, self.rng)))
+        if size is None:
+            size = numpy.broadcast(*(tuple(params) + (mi, ma))).shape
+        elif numpy.isscalar(size):
+            size = (size,)
+        flat = [numpy.broadcast_to(p, size).ravel()
+                for p in tuple(params) + (mi, ma)]
+        ans = numpy.empty(int(numpy.prod(size)))
+        idx = numpy.arange(ans.size)
+        while idx.size:
+            sub = [p[idx] for p in flat]
+            x = draw(self.rng, *(sub[:-2] + [idx.size]))
+            ok = (x >= sub[-2]) & (x <= sub[-1])
+            ans[idx[ok]] = x[ok]
+            stats['drawn'] += idx.size
+            stats['accepted'] += int(ok.sum())
+            idx = idx[~ok]
+            if (idx.size and stats['drawn'] >= self.min_draws and
+                    stats['accepted'] < self.threshold * stats['drawn']):
+                stats['method'] = 'truncated'
+                ans[idx] = truncated(*(
+                    [p[idx] for p in flat] + [None, self.rng]))
+                break
+        return ans.reshape(size)
+
+
+def test():
+    rng = numpy.random.default_rng(0)
+
+    def gen(n=None):
+        return rng.normal(0., 1., n)
+
+    # bounds per element, equal bounds are returned without drawing
+    mi = numpy.array([-1., 0., 2., 0.5])
+    ma = numpy.array([1., 3., 2., 0.6])
+    x = range_generate_regenerate_array(gen, mi, ma, (1000, 4))
+    assert x.shape == (1000, 4)
+    assert ((x >= mi) & (x <= ma)).all() and (x[:, 2] == 2.).all()
+    x = range_generate_regenerate_array(gen, 5., 6., 1000, cntr=2)
+    assert ((x >= 5.) & (x <= 6.)).all() and (x == 5.).any()
+    x = range_generate_doborder_array(gen, -0.1, 0.1, 1000)
+    assert x.min() == -0.1 and x.max() == 0.1
+    for _ in range(100):
+        assert 0.5 <= range_generate_regenerate(gen, 0.5, 0.6) <= 0.6
+    stats = {}
+    x = range_generate_regenerate_array(gen, 0., 10., 1000, stats=stats)
+    assert stats['accepted'] == 1000 and stats['clipped'] == 0
+    assert 1800 < stats['drawn'] < 2200
+    x = range_generate_regenerate_array(gen, 5., 6., 1000, cntr=2,
+                                        stats=stats)
+    assert stats['accepted'] + stats['clipped'] == 2000
+
+    # truncated samplers against means of scipy distributions
+    from scipy import stats as distributions
+
+    n = 100000
+    mu, s = lognormal_meansigma_to_musigma(1., 0.5)
+    scale, shape = gamma_meansigma_to_alphabeta(2., 1.)
+    lognormal = distributions.lognorm(s, scale=numpy.exp(mu))
+    gamma = distributions.gamma(shape, scale=scale)
+    cases = [
+        (truncated_normal(0., 1., 40., 41., n, 1), 40., 41.,
+         distributions.truncnorm(40., 41.).mean()),
+        (truncated_normal(1., 2., -1., 0., n, 1), -1., 0.,
+         distributions.truncnorm(-1., -0.5, 1., 2.).mean()),
+        (truncated_lognormal(1., 0.5, 3., numpy.inf, n, 1), 3., numpy.inf,
+         lognormal.expect(lambda y: y, lb=3., conditional=True)),
+        (truncated_gamma(2., 1., 0., 0.2, n, 1), 0., 0.2,
+         gamma.expect(lambda y: y, lb=0., ub=0.2, conditional=True)),
+        (truncated_gamma(2., 1., 10., 12., n, 1), 10., 12.,
+         gamma.expect(lambda y: y, lb=10., ub=12., conditional=True)),
+        # memoryless, same as [0, 10] shifted by 20
+        (truncated_exponential(1., 20., 30., n, 1), 20., 30.,
+         21. - 10. / numpy.expm1(10.))]
+    for x, lo, hi, mean in cases:
+        assert x.min() >= lo and x.max() <= hi
+        assert abs(x.mean() - mean) < 0.01 * min(1., hi - lo), (lo, hi)
+
+    # block size does not change the sequence
+    def draws(block_size):
+        rng = numpy.random.default_rng(5)
+        gen = BufferedRandom(lambda n: rng.normal(0., 1., n), block_size)
+        return numpy.concatenate([[gen() for _ in range(10)], gen(25),
+                                  [gen()], gen(3)])
+    assert numpy.array_equal(draws(7), draws(4096))
+
+    # streams depend on the key only
+    streams = RandomStreams(1)
+    assert streams.generator('a') is streams.generator('a')
+    first = streams.generator('trial', 3).random(5)
+    assert numpy.array_equal(RandomStreams(1).generator('trial', 3).random(5),
+                             first)
+    assert numpy.array_equal(
+        RandomStreams(1).spawn('trial').generator(3).random(5), first)
+    assert not numpy.array_equal(
+        RandomStreams(1).generator('trial', 4).random(5), first)
+    import pickle
+    state = pickle.loads(pickle.dumps(streams.get_state()))
+    copy = RandomStreams()
+    copy.set_state(state)
+    assert numpy.array_equal(copy.generator('trial', 3).random(5),
+                             streams.generator('trial', 3).random(5))
+    x = RandomStreams(1).generator('a').random()
+    assert x != RandomStreams(1).generator(4294967393).random()
+    assert x != RandomStreams(1).generator('a\x00').random()
+
+    # rejection while it accepts enough, truncated sampling after
+    sampler = AdaptiveSampler(1, min_draws=100)
+    x = sampler('normal', (0., 1.), -1., 1., 1000)
+    assert ((x >= -1.) & (x <= 1.)).all()
+    assert sampler.stats['normal', 0., 1., -1., 1.]['method'] == 'rejection'
+    for _ in range(2):
+        x = sampler('normal', (0., 1.), 3., 4., 1000)
+        assert ((x >= 3.) & (x <= 4.)).all()
+    stats = sampler.stats['normal', 0., 1., 3., 4.]
+    assert stats['method'] == 'truncated' and stats['drawn'] < 2000
+    # array parameters are remembered only under an explicit key
+    mi = numpy.full(1000, 3.)
+    x = sampler('exponential', (1.,), mi, mi + 1.)
+    assert ((x >= mi) & (x <= mi + 1.)).all() and len(sampler.stats) == 2
+    sampler('exponential', (1.,), mi + 5., mi + 6., key='synapses')
+    assert sampler.stats['synapses']['method'] == 'truncated'
+
+
+if __name__ == '__main__':
+    test()
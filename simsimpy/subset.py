@@ -1,6 +1,10 @@
+import json
+import itertools
 from math import floor, ceil
 # from __future__ import print_function
 
+import numpy
+
 
 class SubsetStorage(object):
     """Stores portion of input data, to save space.
@@ -9,37 +13,461 @@ class SubsetStorage(object):
     __getitem__, __setitem__, __len__, __contains__, __delitem__, __str__
     magic, append.
 
+    If dtype or record_shape is given, data is stored in a preallocated
+    array of shape (buf_size,) + record_shape instead of the list, slices
+    are returned as views into it, and blocks of records can be stored at
+    once with append_many.
+
+    If input_size is None, it is not limited. When the buffer fills, every
+    second record is dropped and the following ones are stored twice as
+    rarely, so stored records stay evenly spaced over the whole input.
+
+    Records landing in one slot are reduced by the reduce policy:
+        'last': the last one is kept.
+        'mean': their mean is kept.
+        'minmax': their minimum and maximum are kept, stored record has
+            shape (2,) + record_shape.
+        'reservoir': slots are not used, buf_size records are chosen
+            uniformly from the whole input by reservoir sampling. Their
+            input positions are in indices.
+    Policies other than 'last' use the array mode.
+
+    If filename is given, buffers are kept in a memory-mapped file instead
+    of memory, which uses the array mode too. The file starts with a header
+    of _header_size bytes describing the storage, followed by the buffers.
+    Appended records are collected into batches of about batch_bytes and
+    written at once, the header is updated after every batch. flush writes
+    the pending batch and flushes the file, close flushes and releases it,
+    also at the end of a with block. SubsetStorage.open maps the file again,
+    read-only by default, without reading the buffers.
+
+    If rolling is True, storage is a ring buffer of the last buf_size
+    slots, each of them reducing stride consecutive records, and
+    input_size is ignored. The oldest slot is overwritten when a new one
+    starts. Index 0 is the oldest slot, slices are copies, views gives the
+    two views of the buffer in order.
+
     Attributes:
     buf_size: size of inner buffer of storage.
+    dtype: dtype of the records, None for the list buffer.
+    record_shape: shape of one record.
+    reduce: reduce policy.
+    counts: amount of records reduced into each slot, for 'mean' and
+        'minmax'.
+    indices: input positions of stored records, for 'reservoir'.
+    rolling: True for the ring buffer.
+    filename: file of the buffers, None if they are in memory.
 
     Private attributes:
     _i: inner position in preallocated buffer.
     _j: current position in data for receiving.
     _dif: relative movement of _i when _j increases.
+    _stride: amount of input records per stored one if input_size is None
+        or rolling.
     _buf: buffer.
 
     """
-    def __init__(self, buf_size, input_size):
+    policies = ('last', 'mean', 'minmax', 'reservoir')
+    _magic = b'SUBSETSTORAGE\n'
+    _header_size = 4096
+
+    def __init__(self, buf_size, input_size=None, dtype=None,
+                 record_shape=(), reduce='last', rng=None, rolling=False,
+                 stride=1, filename=None, batch_bytes=65536):
+        if reduce not in self.policies:
+            raise ValueError('Unknown reduce policy %r.' % (reduce,))
+        if rolling and reduce == 'reservoir':
+            raise ValueError('Reservoir can not be rolling.')
         self.buf_size = buf_size
-        self._dif = buf_size / (input_size + 1)
+        self.rolling = rolling
+        if rolling:
+            self._stride = stride
+            self._dif = 1. / stride
+        elif input_size is None:
+            self._stride = 1
+            self._dif = 1.
+        else:
+            self._stride = None
+            self._dif = buf_size / (input_size + 1)
         self._i = 0
         self._j = 0
+        self.record_shape = tuple(record_shape)
+        self.reduce = reduce
+        self.counts = None
+        self.indices = None
+        self.filename = filename
+        self._batch = None
+        self._nbatch = 0
+        if (dtype is None and not self.record_shape and reduce == 'last' and
+                filename is None):
+            self.dtype = None
+            self._buf = [None]*buf_size
+            return
+        self.dtype = numpy.dtype(float if dtype is None else dtype)
+        if reduce == 'reservoir':
+            self._rng = numpy.random.default_rng(rng)
+            self._i = -1
+        if filename is None:
+            for name, shape, dtype in self._layout():
+                setattr(self, name, numpy.zeros(shape, dtype))
+            return
+        self._new_batch(batch_bytes)
+        with open(filename, 'wb') as f:
+            f.write(self._header())
+        self._map('r+', True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _layout(self):
+        """Names, shapes and dtypes of the buffers."""
+        shape = (self.buf_size,) + self.record_shape
+        if self.reduce == 'minmax':
+            shape = (self.buf_size, 2) + self.record_shape
+        layout = [('_buf', shape, self.dtype)]
+        if self.reduce in ('mean', 'minmax'):
+            layout.append(('counts', (self.buf_size,), numpy.int64))
+        elif self.reduce == 'reservoir':
+            layout.append(('indices', (self.buf_size,), numpy.int64))
+        return layout
+
+    def _map(self, mode, create=False):
+        """Maps header and buffers of the file, zeros buffers if create."""
+        self._head = numpy.memmap(self.filename, numpy.uint8, mode, 0,
+                                  self._header_size)
+        offset = self._header_size
+        for name, shape, dtype in self._layout():
+            if create:
+                buf = numpy.memmap(self.filename, dtype, 'r+', offset, shape)
+                buf[...] = 0
+            buf = numpy.memmap(self.filename, dtype, mode, offset, shape)
+            setattr(self, name, buf)
+            offset += -(-buf.nbytes // 8) * 8
+
+    def _header(self):
+        """Header with description and state of the storage."""
+        state = {'dtype': numpy.lib.format.dtype_to_descr(self.dtype),
+                 'buf_size': self.buf_size,
+                 'record_shape': self.record_shape, 'reduce': self.reduce,
+                 'rolling': self.rolling, 'i': int(self._i), 'j': int(self._j),
+                 'dif': float(self._dif), 'stride': self._stride,
+                 'rng': (self._rng.bit_generator.state
+                         if self.reduce == 'reservoir' else None)}
+        header = self._magic + json.dumps(state).encode()
+        if len(header) >= self._header_size:
+            raise ValueError('SubsetStorage header does not fit.')
+        return header.ljust(self._header_size - 1) + b'\n'
 
-        self._buf = [None]*buf_size
+    @classmethod
+    def open(cls, filename, mode='r', batch_bytes=65536):
+        """Maps storage saved in filename, read-only unless mode is 'r+'.
+
+        Records of the read-only storage are views into the file.
+        """
+        with open(filename, 'rb') as f:
+            header = f.read(cls._header_size)
+        if not header.startswith(cls._magic):
+            raise ValueError('%s is not a SubsetStorage file.' % filename)
+        state = json.loads(header[len(cls._magic):].decode())
+        self = cls.__new__(cls)
+        self.buf_size = state['buf_size']
+        self.dtype = numpy.lib.format.descr_to_dtype(state['dtype'])
+        self.record_shape = tuple(state['record_shape'])
+        self.reduce = state['reduce']
+        self.rolling = state['rolling']
+        self._i = state['i']
+        self._j = state['j']
+        self._dif = state['dif']
+        self._stride = state['stride']
+        self.counts = None
+        self.indices = None
+        self.filename = filename
+        self._batch = None
+        self._nbatch = 0
+        if self.reduce == 'reservoir':
+            self._rng = numpy.random.default_rng()
+            self._rng.bit_generator.state = state['rng']
+        self._map(mode)
+        if mode != 'r':
+            self._new_batch(batch_bytes)
+        return self
+
+    def _new_batch(self, batch_bytes):
+        """Allocates batch of records of about batch_bytes."""
+        size = numpy.empty(self.record_shape, self.dtype).nbytes
+        self._batch = numpy.empty(
+            (max(1, batch_bytes // max(1, size)),) + self.record_shape,
+            self.dtype)
+
+    def _sync(self):
+        """Writes the pending batch of records."""
+        if self._nbatch:
+            n = self._nbatch
+            self._nbatch = 0
+            try:
+                self._append_many(self._batch[:n])
+            finally:
+                self._write_header()
+
+    def _write_header(self):
+        """Updates the header of a writable file."""
+        if self._batch is not None:
+            self._head[:] = numpy.frombuffer(self._header(), numpy.uint8)
+
+    def flush(self):
+        """Writes pending records and the header to the file."""
+        if self.filename is None:
+            return
+        self._sync()
+        for name, _, _ in self._layout() + [('_head', None, None)]:
+            buf = getattr(self, name)
+            if buf is not None and buf.flags.writeable:
+                buf.flush()
+
+    def close(self):
+        """Flushes and releases the file."""
+        if self.filename is None:
+            return
+        self.flush()
+        for name, _, _ in self._layout() + [('_head', None, None)]:
+            setattr(self, name, None)
+        self._batch = None
 
     def append(self, d):
-        self._i = int(floor(self._j * self._dif))
-        if self._i >= self.buf_size:
-            self._i -= 1
-            raise BufferError('Stack is full.')
+        if self._batch is not None:
+            if (self._stride is None and self.indices is None and
+                    floor((self._j + self._nbatch) * self._dif) >=
+                    self.buf_size):
+                self._sync()
+                raise BufferError('Stack is full.')
+            self._batch[self._nbatch] = d
+            self._nbatch += 1
+            if self._nbatch == len(self._batch):
+                self._sync()
+            return
+        if self.indices is not None:
+            self._sample(d)
+            return
+        if self.rolling:
+            self._i = (self._j // self._stride) % self.buf_size
+            if self.counts is not None and not self._j % self._stride:
+                self.counts[self._i] = 0
+        else:
+            self._i = int(floor(self._j * self._dif))
+            if self._i >= self.buf_size:
+                if self._stride is None:
+                    self._i -= 1
+                    raise BufferError('Stack is full.')
+                self._compact()
+                self._i = int(floor(self._j * self._dif))
+
+        if self.counts is None:
+            self._buf[self._i] = d
+        else:
+            self._add(self._i, d)
+        self._j += 1
+
+    def _add(self, i, d):
+        """Reduces record d into slot i."""
+        c = self.counts[i]
+        if not c:
+            self._buf[i] = d
+        elif self.reduce == 'mean':
+            self._buf[i] += (d - self._buf[i]) / (c + 1)
+        else:
+            self._buf[i, 0] = numpy.minimum(self._buf[i, 0], d)
+            self._buf[i, 1] = numpy.maximum(self._buf[i, 1], d)
+        self.counts[i] = c + 1
 
-        self._buf[self._i] = d
+    def _sample(self, d):
+        """Reservoir sampling of record d."""
+        i = self._j
+        if i >= self.buf_size:
+            i = int(self._rng.integers(self._j + 1))
+        if i < self.buf_size:
+            self._buf[i] = d
+            self.indices[i] = self._j
         self._j += 1
+        self._i = min(self._j, self.buf_size) - 1
+
+    def append_many(self, block):
+        """Appends records of block, same as append for each of them.
+
+        In array mode the records are scattered into their places with one
+        vectorized assignment.
+        """
+        if self.dtype is None:
+            for d in block:
+                self.append(d)
+            return
+        self._sync()
+        try:
+            self._append_many(numpy.asarray(block))
+        finally:
+            self._write_header()
+
+    def _append_many(self, block):
+        """append_many of array mode."""
+        if self.indices is not None:
+            self._sample_many(block)
+            return
+        if self.rolling:
+            self._roll(block)
+            return
+        while True:
+            n = self._scatter(block)
+            if n == len(block):
+                return
+            if self._stride is None:
+                raise BufferError('Stack is full.')
+            block = block[n:]
+            self._compact()
+
+    def _scatter(self, block):
+        """Stores records of block that fit, returns their amount."""
+        js = self._j + numpy.arange(len(block))
+        slots = numpy.floor(js * self._dif).astype(numpy.intp)
+        n = int(numpy.searchsorted(slots, self.buf_size))
+        if n:
+            self._store(slots[:n], block[:n])
+        return n
+
+    def _roll(self, block):
+        """Stores records of block into the ring buffer."""
+        if not len(block):
+            return
+        js = self._j + numpy.arange(len(block))
+        bins = js // self._stride
+        # records of slots overwritten within the block are skipped
+        n = int(numpy.searchsorted(bins, bins[-1] - self.buf_size + 1))
+        js = js[n:]
+        slots = bins[n:] % self.buf_size
+        if self.counts is not None:
+            self.counts[slots[js % self._stride == 0]] = 0
+        self._j += n
+        self._store(slots, block[n:])
+
+    def _store(self, slots, block):
+        """Reduces block into slots, records of one slot go in a row."""
+        n = len(block)
+        # runs of records landing in the same slot
+        first = numpy.flatnonzero(slots[1:n] != slots[:n-1]) + 1
+        first = numpy.append(0, first)
+        last = numpy.append(first[1:] - 1, n - 1)
+        u = slots[first]
+        if self.counts is None:
+            self._buf[u] = block[last]
+        else:
+            c0 = self.counts[u]
+            c = numpy.diff(numpy.append(first, n))
+            old = (c0 > 0).reshape((-1,) + (1,)*len(self.record_shape))
+            if self.reduce == 'mean':
+                w = (c0 / (c0 + c)).reshape(old.shape)
+                sums = numpy.add.reduceat(block[:n], first, axis=0)
+                self._buf[u] = (numpy.where(old, self._buf[u], 0) * w +
+                                sums / (c0 + c).reshape(old.shape))
+            else:
+                low = numpy.minimum.reduceat(block[:n], first, axis=0)
+                high = numpy.maximum.reduceat(block[:n], first, axis=0)
+                self._buf[u, 0] = numpy.where(
+                    old, numpy.minimum(self._buf[u, 0], low), low)
+                self._buf[u, 1] = numpy.where(
+                    old, numpy.maximum(self._buf[u, 1], high), high)
+            self.counts[u] = c0 + c
+        self._i = int(slots[n - 1])
+        self._j += n
+
+    def _sample_many(self, block):
+        """Reservoir sampling of records of block."""
+        js = self._j + numpy.arange(len(block))
+        slots = js.copy()
+        full = js >= self.buf_size
+        slots[full] = self._rng.integers(js[full] + 1)
+        taken = numpy.flatnonzero(slots < self.buf_size)
+        # only the last record landing in a slot stays there
+        u, rev = numpy.unique(slots[taken][::-1], return_index=True)
+        taken = taken[len(taken) - 1 - rev]
+        self._buf[u] = block[taken]
+        self.indices[u] = js[taken]
+        self._j += len(block)
+        self._i = min(self._j, self.buf_size) - 1
+
+    def _compact(self):
+        """Merges pairs of slots and doubles the stride.
+
+        Merged slot keeps the reduction of both, the last slot of odd
+        buf_size stays as it is and continues to fill.
+        """
+        m = (self.buf_size + 1) // 2
+        keep = [min(2*k + 1, self.buf_size - 1) for k in range(m)]
+        if self.dtype is None:
+            self._buf[:m] = [self._buf[k] for k in keep]
+            self._buf[m:] = [None]*(self.buf_size - m)
+        elif self.counts is None:
+            self._buf[:m] = self._buf[keep]
+        else:
+            a = numpy.arange(0, self.buf_size, 2)
+            b = numpy.array(keep)
+            ca = self.counts[a]
+            cb = numpy.where(a == b, 0, self.counts[b])
+            if self.reduce == 'mean':
+                shape = (-1,) + (1,)*len(self.record_shape)
+                self._buf[:m] = (
+                    self._buf[a] * (ca / (ca + cb)).reshape(shape) +
+                    self._buf[b] * (cb / (ca + cb)).reshape(shape))
+            else:
+                self._buf[:m, 0] = numpy.minimum(self._buf[a, 0],
+                                                 self._buf[b, 0])
+                self._buf[:m, 1] = numpy.maximum(self._buf[a, 1],
+                                                 self._buf[b, 1])
+            self.counts[:m] = ca + cb
+            self.counts[m:] = 0
+        self._stride *= 2
+        self._dif = 1. / self._stride
+        self._i = m - 1
 
     def __len__(self):
+        self._sync()
+        if self.rolling:
+            return min(-(-self._j // self._stride), self.buf_size)
         return self._i + 1
 
+    def _oldest(self):
+        """Position of the oldest slot of the ring buffer."""
+        return (-(-self._j // self._stride) - len(self)) % self.buf_size
+
+    def views(self):
+        """Stored records as two views in order, the second may be empty.
+
+        Not rolling storage is returned as one view and an empty one.
+        """
+        self._sync()
+        n = len(self)
+        start = self._oldest() if self.rolling else 0
+        end = start + n - self.buf_size
+        if end <= 0:
+            return self._buf[start:start + n], self._buf[:0]
+        return self._buf[start:], self._buf[:end]
+
+    def as_array(self):
+        """Stored records in order as an array, a copy if rolling."""
+        self._sync()
+        if self.dtype is None:
+            first, second = self.views()
+            return numpy.array(first + second)
+        if not self.rolling:
+            return self._buf[:len(self)]
+        return numpy.concatenate(self.views())
+
     def __getitem__(self, sl):
+        self._sync()
+        if self.rolling:
+            if isinstance(sl, slice):
+                return self.as_array()[sl]
+            return self._buf[self._position(sl)]
         if isinstance(sl, slice):
             start, stop, step = sl.indices(len(self))
             sl = slice(start, stop, step)
@@ -51,7 +479,17 @@ class SubsetStorage(object):
 
         return self._buf[sl]
 
+    def _position(self, key):
+        """Position of key-th record of the ring buffer."""
+        if not -len(self) <= key < len(self):
+            raise IndexError
+        return (self._oldest() + key % len(self)) % self.buf_size
+
     def __setitem__(self, key, value):
+        self._sync()
+        if self.rolling:
+            self._buf[self._position(key)] = value
+            return
         if key > len(self):
             raise IndexError
         if key < 0:
@@ -60,28 +498,49 @@ class SubsetStorage(object):
         self._buf[key] = value
 
     def __iter__(self):
-        return self._buf[:len(self)]
+        self._sync()
+        if self.rolling:
+            first, second = self.views()
+            return itertools.chain(first, second)
+        return iter(self._buf[:len(self)])
 
     def __contains__(self, item):
+        self._sync()
+        if self.rolling:
+            return any(item in view for view in self.views())
         return item in self._buf[:len(self)]
 
     def __delitem__(self, key):
+        self._sync()
+        if self.rolling:
+            raise TypeError('Rolling SubsetStorage does not support del.')
+        if self.indices is not None:
+            # the rest of the sample would not be uniform any more
+            raise TypeError('Reservoir SubsetStorage does not support del.')
         if key > len(self):
             raise IndexError
         if key < 0:
             key += len(self)
 
-        # print self._buf
-        del self._buf[key]
-        # print self._buf
+        if self.dtype is None:
+            del self._buf[key]
+            self._buf.append(None)
+        else:
+            self._buf[key:-1] = self._buf[key+1:]
+            if self.counts is not None:
+                self.counts[key:-1] = self.counts[key+1:]
+                self.counts[-1] = 0
 
         # print self._j, int(floor(self._j * self._dif)),
         self._j -= int(ceil(1./self._dif))
         # print 1./self._dif, self._j, int(floor(self._j * self._dif))
-        self._buf.append(None)
         self._i = int(floor(self._j * self._dif))
+        self._write_header()
 
     def __str__(self):
+        self._sync()
+        if self.rolling:
+            return str(self.as_array())
         return str(self._buf[:len(self)])
 
 
@@ -107,6 +566,110 @@ def test():
     print(a)
     print(a[:], a[-1])
 
+    # typed storage keeps the same records as the list one
+    b = SubsetStorage(5, 13)
+    c = SubsetStorage(5, 13, dtype=int)
+    for i in range(13):
+        b.append(i)
+        c.append(i)
+    assert list(b) == list(c) and c[:].dtype == int
+    try:
+        for i in range(13, 20):
+            c.append(i)
+        raise AssertionError('full storage accepted a record')
+    except BufferError:
+        print('full at', i, c)
+
+    # append and append_many of the same records agree
+    data = numpy.random.default_rng(0).normal(size=(500, 2))
+    modes = [dict(input_size=500)]
+    modes.append(dict())
+    modes += [dict(input_size=500, reduce='mean'), dict(reduce='minmax'),
+              dict(input_size=500, reduce='reservoir', rng=1)]
+    modes += [dict(rolling=True, stride=3),
+              dict(rolling=True, stride=4, reduce='mean')]
+    for kwargs in modes:
+        one = SubsetStorage(20, dtype=float, record_shape=(2,), **kwargs)
+        many = SubsetStorage(20, dtype=float, record_shape=(2,), **kwargs)
+        for d in data:
+            one.append(d)
+        many.append_many(data[:123])
+        many.append_many(data[123:])
+        assert len(one) == len(many), kwargs
+        assert numpy.allclose(one[:], many[:]), kwargs
+        print(kwargs, len(one), 'ok')
+
+    # storage of unknown input length keeps the last of every stride records
+    d = SubsetStorage(8, dtype=int)
+    d.append_many(range(100))
+    assert list(d) == list(range(15, 100, 16)) + [99]
+
+    # records of a slot are reduced
+    m = SubsetStorage(4, 11, dtype=float, reduce='mean')
+    m.append_many(numpy.arange(11.))
+    slots = numpy.floor(numpy.arange(11) * 4 / 12.).astype(int)
+    assert numpy.allclose(m[:], numpy.bincount(slots, range(11)) /
+                          numpy.bincount(slots))
+    m = SubsetStorage(4, 11, dtype=float, reduce='minmax')
+    m.append_many(numpy.arange(11.))
+    assert m[:][:, 1].tolist() == [2., 5., 8., 10.]
+    # reservoir keeps a uniform sample of the input
+    counts = numpy.zeros(100)
+    for seed in range(200):
+        r = SubsetStorage(10, reduce='reservoir', dtype=int, rng=seed)
+        r.append_many(range(100))
+        assert (r.indices == r[:]).all()
+        counts[r[:]] += 1
+    assert counts.min() > 5 and counts.max() < 40
+    try:
+        del r[0]
+        raise AssertionError('record was deleted from the reservoir')
+    except TypeError:
+        pass
+
+    # ring buffer keeps the last records
+    b = SubsetStorage(4, dtype=int, rolling=True)
+    b.append_many(range(10))
+    assert list(b) == [6, 7, 8, 9] and b[-1] == 9 and b[0] == 6
+    b.append(10)
+    assert list(b) == [7, 8, 9, 10] and 6 not in b
+
+    # file backend, reopened read-only after close
+    import os
+    import tempfile
+    filename = os.path.join(tempfile.mkdtemp(), 'subset.dat')
+    for kwargs in modes:
+        mem = SubsetStorage(20, dtype=float, record_shape=(2,), **kwargs)
+        mem.append_many(data)
+        f = SubsetStorage(20, dtype=float, record_shape=(2,),
+                          filename=filename, batch_bytes=256, **kwargs)
+        for d in data:
+            f.append(d)
+        f.close()
+        f = SubsetStorage.open(filename)
+        assert len(f) == len(mem), kwargs
+        assert numpy.allclose(f.as_array(), mem.as_array()), kwargs
+        try:
+            f[0] = 0.
+            raise AssertionError('read-only storage was changed')
+        except ValueError:
+            pass
+        f.close()
+
+    # full file storage raises at once, header follows the batches
+    with SubsetStorage(5, 13, dtype=int, filename=filename,
+                       batch_bytes=16) as f:
+        try:
+            for i in range(20):
+                f.append(i)
+            raise AssertionError('full storage accepted a record')
+        except BufferError:
+            assert i == 14
+        assert list(SubsetStorage.open(filename)) == list(c)
+    assert list(SubsetStorage.open(filename)) == list(c)
+    os.remove(filename)
+    print('file backend ok')
+
 
 if __name__ == '__main__':
     test()